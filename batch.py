@@ -0,0 +1,452 @@
+import glob
+import json
+import queue
+import multiprocessing
+import traceback
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    as_completed
+from typing import Dict, List, NamedTuple, Optional
+
+from catalog import open_catalog, record_fix, upsert_session
+from fix_nondoc_pickle import FixMetrics, fix_hashed_behavior_pickle, \
+    fix_loaded_pickle, load_hashed_behavior_pickle, measure_stage, \
+    write_output
+from manifest import fix_logic_version, is_fix_current, \
+    make_manifest_entry, save_manifest
+from transaction_log import attach_log_queue, logger, transaction
+
+
+class FixResult(NamedTuple):
+    target_pickle: str
+    output_path: Optional[str]
+    error: Optional[str]
+    skipped: bool = False
+    manifest_entry: Optional[Dict] = None
+    metrics: Optional[FixMetrics] = None
+
+
+def fix_target_pickle(
+    target_pickle: str,
+    output_dir: str,
+    manifest_entry: Optional[Dict] = None,
+    collect_metrics: bool = False,
+    trace_memory: bool = False,
+    **kwargs
+) -> FixResult:
+    """Fixes a single behavior pickle for a batch, failures are returned
+    instead of raised so they dont stop the rest of the batch
+
+    Notes
+    -----
+    - skips pickles whose `manifest_entry` shows they were already fixed by
+    the current fix logic
+    - if `collect_metrics` is True the result has the `FixMetrics` of the fix,
+    `trace_memory` is passed to it
+    - the target pickle is hashed for its manifest entry as its loaded, so
+    its only read once
+    """
+    writer = kwargs.get("writer", "protocol0")
+    output_mode = kwargs.get("output_mode", "pickle")
+    verify_checks = kwargs.get("verify_checks", False)
+    try:
+        is_current, entry = is_fix_current(
+            target_pickle, manifest_entry, writer, output_mode, verify_checks)
+        if is_current:
+            logger.info(
+                "Skipping unchanged pickle: %s", target_pickle,
+                extra=transaction(target_pickle))
+            return FixResult(
+                target_pickle, entry["output_path"], None, True, entry)
+
+        metrics = FixMetrics(trace_memory) if collect_metrics else None
+        fixed_pickle_path, input_hash = fix_hashed_behavior_pickle(
+            target_pickle, output_dir, metrics=metrics, **kwargs)
+        logger.info(
+            "Fixed pickle saved to: %s", fixed_pickle_path,
+            extra=transaction(target_pickle))
+        return FixResult(
+            target_pickle,
+            fixed_pickle_path,
+            None,
+            False,
+            make_manifest_entry(
+                target_pickle, fixed_pickle_path, writer, output_mode,
+                input_hash, verify_checks),
+            metrics,
+        )
+    except Exception:
+        logger.error(
+            "Failed to fix pickle. target=%s.", target_pickle,
+            exc_info=True, extra=transaction(target_pickle))
+        return FixResult(target_pickle, None, traceback.format_exc())
+
+
+def fix_behavior_pickles(
+    target_pickles: List[str],
+    output_dir: str,
+    workers: int = 1,
+    manifest: Optional[Dict[str, Dict]] = None,
+    log_queue: Optional[multiprocessing.Queue] = None,
+    **kwargs
+) -> List[FixResult]:
+    """Fixes a batch of behavior pickles, in a pool of `workers` processes if
+    `workers` is more than 1
+
+    Notes
+    -----
+    - kwargs are passed to `fix_target_pickle`
+    - results are in the same order as `target_pickles`
+    - if a `manifest` is supplied, pickles it records as already fixed are
+    skipped and it is updated and saved to `output_dir` as each pickle
+    finishes, so an interrupted batch resumes where it stopped
+    - worker processes send their log records to `log_queue`, the queue of
+    an open transaction log
+    """
+    def record(result: FixResult) -> None:
+        if manifest is not None and result.manifest_entry is not None:
+            manifest[result.target_pickle] = result.manifest_entry
+            save_manifest(output_dir, manifest)
+
+    def get_entry(target_pickle: str) -> Optional[Dict]:
+        if manifest is None:
+            return None
+        return manifest.get(target_pickle)
+
+    if workers < 2:
+        results = []
+        for target_pickle in target_pickles:
+            result = fix_target_pickle(
+                target_pickle, output_dir, get_entry(target_pickle), **kwargs)
+            record(result)
+            results.append(result)
+        return results
+
+    results = {}
+    initializer, initargs = None, ()
+    if log_queue is not None:
+        initializer, initargs = attach_log_queue, (log_queue, )
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=initializer,
+            initargs=initargs) as executor:
+        futures = {
+            executor.submit(
+                fix_target_pickle,
+                target_pickle,
+                output_dir,
+                get_entry(target_pickle),
+                **kwargs
+            ): target_pickle
+            for target_pickle in target_pickles
+        }
+        for future in as_completed(futures):
+            target_pickle = futures[future]
+            try:
+                results[target_pickle] = future.result()
+            except Exception:
+                # the worker itself died, eg: it was killed for running out
+                # of memory
+                logger.error(
+                    "Worker failed fixing pickle. target=%s.", target_pickle,
+                    exc_info=True, extra=transaction(target_pickle))
+                results[target_pickle] = FixResult(
+                    target_pickle, None, traceback.format_exc())
+            record(results[target_pickle])
+
+    return [results[target_pickle] for target_pickle in target_pickles]
+
+
+def find_target_pickle(output_dir: str) -> Optional[str]:
+    pickles = list(glob.glob(output_dir + "/*.behavior.pkl"))
+    if len(pickles) > 1:
+        logger.error(
+            "More than one pickle detected in output dir: %s" % output_dir)
+    elif not len(pickles) > 0:
+        logger.error("No pickles in directory: %s" % output_dir)
+        return None
+
+    return pickles[0]
+
+
+def find_target_pickles(output_dirs: List[str]) -> List[str]:
+    target_pickles = []
+    for output_dir in output_dirs:
+        target_pickle = find_target_pickle(output_dir)
+        if target_pickle is not None:
+            target_pickles.append(target_pickle)
+
+    return target_pickles
+
+
+def fix_behavior_pickles_pipelined(
+    output_dirs: List[str],
+    output_dir: str,
+    manifest: Optional[Dict[str, Dict]] = None,
+    force: bool = False,
+    prefetch: int = 2,
+    write_behind: int = 2,
+    discovery_workers: int = 8,
+    copy_mode: str = "inplace",
+    writer: str = "protocol0",
+    output_mode: str = "pickle",
+    atomic: bool = False,
+    verify_roundtrip: bool = False,
+    verify_checks: bool = False,
+    collect_metrics: bool = False,
+) -> List[FixResult]:
+    """Finds and fixes the pickles in `output_dirs` in a pipeline, in a
+    single process
+
+    Notes
+    -----
+    - the directories are searched by `discovery_workers` threads at once,
+    a thread loads the next `prefetch` pickles while the current one is
+    fixed and another writes fixed pickles in the background, up to
+    `write_behind` of them wait to be written. Loading and writing are
+    mostly waiting on the network so they overlap with fixing
+    - the queues between the stages are bounded, so at most about
+    `prefetch` + `write_behind` + 3 sessions are in memory at once
+    - the manifest is used and updated like by `fix_behavior_pickles`, with
+    `force` every pickle is fixed again
+    - results are in the order of `output_dirs`, metrics dont trace memory
+    since stages run at the same time
+    """
+    load_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=write_behind)
+    lock = threading.Lock()
+    target_pickles = []
+    results = {}
+
+    def record(result: FixResult) -> None:
+        with lock:
+            results[result.target_pickle] = result
+            if manifest is not None and result.manifest_entry is not None:
+                manifest[result.target_pickle] = result.manifest_entry
+                save_manifest(output_dir, manifest)
+
+    def record_error(target_pickle: str) -> None:
+        logger.error(
+            "Failed to fix pickle. target=%s.", target_pickle,
+            exc_info=True, extra=transaction(target_pickle))
+        record(FixResult(target_pickle, None, traceback.format_exc()))
+
+    def load() -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=discovery_workers) as executor:
+                for target_pickle in executor.map(find_target_pickle, output_dirs):
+                    if target_pickle is None:
+                        continue
+                    target_pickles.append(target_pickle)
+                    try:
+                        entry = None
+                        if manifest is not None and not force:
+                            entry = manifest.get(target_pickle)
+                        is_current, entry = is_fix_current(
+                            target_pickle, entry, writer, output_mode,
+                            verify_checks)
+                        if is_current:
+                            logger.info(
+                                "Skipping unchanged pickle: %s", target_pickle,
+                                extra=transaction(target_pickle))
+                            record(FixResult(
+                                target_pickle, entry["output_path"], None, True, entry))
+                            continue
+
+                        metrics = FixMetrics() if collect_metrics else None
+                        with measure_stage(metrics, "load"):
+                            data, input_hash = load_hashed_behavior_pickle(
+                                target_pickle)
+                        # blocks while `prefetch` sessions are waiting
+                        load_queue.put(
+                            (target_pickle, data, input_hash, metrics, ))
+                        del data
+                    except Exception:
+                        record_error(target_pickle)
+        finally:
+            load_queue.put(None)
+
+    def write() -> None:
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            target_pickle, fixed, output_path, input_hash, metrics = item
+            del item
+            try:
+                with measure_stage(metrics, "write"):
+                    write_output(
+                        fixed,
+                        output_path,
+                        output_mode,
+                        writer=writer,
+                        atomic=atomic,
+                        verify_roundtrip=verify_roundtrip,
+                    )
+                del fixed
+                logger.info(
+                    "Fixed pickle saved to: %s", output_path,
+                    extra=transaction(target_pickle))
+                record(FixResult(
+                    target_pickle,
+                    output_path,
+                    None,
+                    False,
+                    make_manifest_entry(
+                        target_pickle, output_path, writer, output_mode,
+                        input_hash, verify_checks),
+                    metrics,
+                ))
+            except Exception:
+                record_error(target_pickle)
+
+    loader = threading.Thread(target=load, daemon=True)
+    writer_thread = threading.Thread(target=write, daemon=True)
+    loader.start()
+    writer_thread.start()
+    try:
+        while True:
+            item = load_queue.get()
+            if item is None:
+                break
+            target_pickle, data, input_hash, metrics = item
+            del item
+            try:
+                fixed, output_path = fix_loaded_pickle(
+                    target_pickle,
+                    data,
+                    output_dir,
+                    copy_mode=copy_mode,
+                    writer=writer,
+                    output_mode=output_mode,
+                    metrics=metrics,
+                    verify_checks=verify_checks,
+                    input_hash=input_hash,
+                )
+                del data
+                # blocks while `write_behind` sessions are waiting
+                write_queue.put(
+                    (target_pickle, fixed, output_path, input_hash, metrics, ))
+                del fixed
+            except Exception:
+                record_error(target_pickle)
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+    loader.join()
+
+    return [results[target_pickle] for target_pickle in target_pickles]
+
+
+def aggregate_metrics(results: List[FixResult]) -> Dict:
+    """Totals the metrics of a batch
+
+    Notes
+    -----
+    - stage times and counts are summed, peak memory is the largest peak of
+    any session
+    """
+    stages = {}
+    counts = Counter()
+    n_sessions = 0
+    for result in results:
+        if result.metrics is None:
+            continue
+        n_sessions += 1
+        counts.update(result.metrics.counts)
+        for name, stage in result.metrics.stages.items():
+            total = stages.setdefault(
+                name, {"seconds": 0.0, "peak_bytes": None, })
+            total["seconds"] += stage["seconds"]
+            if stage["peak_bytes"] is not None:
+                total["peak_bytes"] = max(
+                    total["peak_bytes"] or 0, stage["peak_bytes"])
+
+    return {
+        "sessions": n_sessions,
+        "stages": stages,
+        "counts": dict(counts),
+    }
+
+
+def write_metrics(results: List[FixResult], metrics_path: str) -> None:
+    """Writes the metrics of each fixed pickle as json lines, followed by
+    their aggregate
+    """
+    with open(metrics_path, "w") as f:
+        for result in results:
+            if result.metrics is None:
+                continue
+            f.write(json.dumps(dict(
+                result.metrics.to_dict(),
+                target_pickle=result.target_pickle,
+                output_path=result.output_path,
+            )) + "\n")
+        f.write(json.dumps(dict(
+            aggregate_metrics(results),
+            target_pickle=None,
+        )) + "\n")
+
+
+def print_metrics(aggregate: Dict) -> None:
+    print("Metrics of %s fixed pickles:" % aggregate["sessions"])
+    for name, stage in aggregate["stages"].items():
+        if stage["peak_bytes"] is None:
+            print("  %s: %.3fs" % (name, stage["seconds"], ))
+        else:
+            print("  %s: %.3fs, peak %.1fMB" % (
+                name, stage["seconds"], stage["peak_bytes"] / 1024 ** 2, ))
+    for name, count in sorted(aggregate["counts"].items()):
+        print("  %s: %s" % (name, count, ))
+
+
+def catalog_fix_results(
+    catalog_path: str,
+    results: List[FixResult],
+    writer: str = "protocol0",
+    output_mode: str = "pickle",
+) -> None:
+    """Records a batch in the catalog at `catalog_path`
+
+    Notes
+    -----
+    - skipped pickles only update their session, fix counts are recorded if
+    the batch collected metrics
+    """
+    connection = open_catalog(catalog_path)
+    try:
+        with connection:
+            for result in results:
+                entry = result.manifest_entry or {}
+                if result.skipped:
+                    upsert_session(
+                        connection, result.target_pickle, entry.get("input_hash"))
+                    continue
+                record_fix(
+                    connection,
+                    result.target_pickle,
+                    entry.get("fix_version", fix_logic_version),
+                    content_hash=entry.get("input_hash"),
+                    writer=writer,
+                    output_mode=output_mode,
+                    output_path=result.output_path,
+                    output_hash=entry.get("output_hash"),
+                    error=result.error,
+                    counts=dict(result.metrics.counts)
+                    if result.metrics is not None else None,
+                )
+    finally:
+        connection.close()
+
+
+def print_summary(results: List[FixResult]) -> None:
+    failed = [result for result in results if result.error is not None]
+    skipped = [result for result in results if result.skipped]
+    print("Fixed %s/%s pickles, %s unchanged and skipped, %s failed." % (
+        len(results) - len(failed) - len(skipped), len(results),
+        len(skipped), len(failed), ))
+    for result in failed:
+        print("Error fixing pickle: %s" % result.target_pickle)
+
+
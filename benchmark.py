@@ -0,0 +1,203 @@
+import os
+import sys
+import copy
+import json
+import pickle
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import fix_nondoc_pickle
+from synthetic_session import Faults, default_faults, make_session
+from tests.checks import CheckedSession, checks
+
+
+default_sizes = [100, 1000, 10000, ]
+
+# imported by every pytest run and fixer worker
+default_import_modules = ["tests", "fix_nondoc_pickle", ]
+
+
+def time_call(fn: Callable, setup: Callable = lambda: None, repeat: int = 5) -> List[float]:
+    """Times `fn` called with whatever `setup` returns, `setup` isnt timed
+    """
+    seconds = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        fn(args)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def time_import(module: str, repeat: int = 5) -> List[float]:
+    """Times importing `module` in a new interpreter each time, so none of
+    what it imports is already loaded
+    """
+    code = "import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)" % module
+    seconds = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code, ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        seconds.append(float(output))
+    return seconds
+
+
+def run_import_benchmarks(
+    modules: List[str] = default_import_modules,
+    repeat: int = 5,
+) -> List[Dict]:
+    """Benchmarks cold imports of `modules`, records are like the ones of
+    `run_benchmarks` with `n_trials` None
+    """
+    records = []
+    for module in modules:
+        seconds = time_import(module, repeat)
+        records.append({
+            "benchmark": "import %s" % module,
+            "n_trials": None,
+            "best": min(seconds),
+            "median": float(np.median(seconds)),
+            "repeat": repeat,
+        })
+    return records
+
+
+def copy_trial_log(data: Dict) -> List[Dict]:
+    return [dict(trial) for trial in data["items"]["behavior"]["trial_log"]]
+
+
+def fix_trial_log(trial_log: List[Dict]) -> None:
+    for trial in trial_log:
+        fix_nondoc_pickle.fix_lick_disabled_log(trial)
+
+
+def benchmark_session(data: Dict, work_dir: str, repeat: int = 5) -> Dict[str, List[float]]:
+    """Times the fixer and each check on a session
+
+    Notes
+    -----
+    - `fix_trials` and `fix_images` are timed with their default deep copy
+    - checks are timed on the fixed session, like they're run on fixed
+    pickles
+    """
+    timings = {}
+    timings["fix_trials"] = time_call(
+        fix_nondoc_pickle.fix_trials, lambda: data, repeat)
+    timings["fix_images"] = time_call(
+        fix_nondoc_pickle.fix_images, lambda: data, repeat)
+    timings["fix_lick_disabled_log"] = time_call(
+        fix_trial_log, lambda: copy_trial_log(data), repeat)
+
+    pickle_path = os.path.join(work_dir, "session.behavior.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump(data, f, protocol=0)
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    timings["fix_behavior_pickle"] = time_call(
+        lambda _: fix_nondoc_pickle.fix_behavior_pickle(pickle_path, output_dir),
+        repeat=repeat,
+    )
+
+    fixed = fix_nondoc_pickle.run_fix_passes(
+        copy.deepcopy(data), fix_nondoc_pickle.default_fix_passes)
+    timings["checked_session"] = time_call(
+        CheckedSession.from_raw, lambda: fixed, repeat)
+    session = CheckedSession.from_raw(fixed)
+    for name, check in checks.items():
+        timings["test_%s" % name] = time_call(check, lambda: session, repeat)
+
+    return timings
+
+
+def run_benchmarks(
+    sizes: List[int] = default_sizes,
+    faults: Faults = default_faults,
+    repeat: int = 5,
+    seed: int = 0,
+) -> List[Dict]:
+    """Benchmarks the fixer and checks on synthetic sessions of each size
+
+    Returns
+    -------
+    a record per benchmark and size with the best and median time
+    """
+    records = []
+    for n_trials in sizes:
+        data = make_session(n_trials, faults, seed)
+        with tempfile.TemporaryDirectory() as work_dir:
+            timings = benchmark_session(data, work_dir, repeat)
+        for name, seconds in timings.items():
+            records.append({
+                "benchmark": name,
+                "n_trials": n_trials,
+                "best": min(seconds),
+                "median": float(np.median(seconds)),
+                "repeat": repeat,
+            })
+    return records
+
+
+def print_records(records: List[Dict]):
+    for record in records:
+        print("%-40s %8s trials  best %.6fs  median %.6fs" % (
+            record["benchmark"],
+            record["n_trials"] if record["n_trials"] is not None else "-",
+            record["best"],
+            record["median"],
+        ))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=default_sizes,
+        help="Trial counts of the synthetic sessions",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-faults",
+        action="store_true",
+        help="Generate sessions without any of the faults the fixer fixes",
+    )
+    parser.add_argument(
+        "--imports",
+        type=str,
+        nargs="*",
+        default=default_import_modules,
+        help="Modules to time the cold import of, none to skip",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path to write the results to as JSON lines",
+    )
+
+    args = parser.parse_args()
+
+    records = run_import_benchmarks(args.imports, args.repeat)
+    records += run_benchmarks(
+        sizes=args.sizes,
+        faults=Faults() if args.no_faults else default_faults,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    print_records(records)
+    if args.output:
+        with open(args.output, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
@@ -0,0 +1,212 @@
+import re
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    mouse_id TEXT,
+    date TEXT,
+    pickle_path TEXT NOT NULL,
+    content_hash TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_mouse_id ON sessions (mouse_id);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+
+CREATE TABLE IF NOT EXISTS fix_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (session_id),
+    content_hash TEXT,
+    fixed_at REAL NOT NULL,
+    fix_version TEXT NOT NULL,
+    writer TEXT,
+    output_mode TEXT,
+    output_path TEXT,
+    output_hash TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS fix_runs_session_id ON fix_runs (session_id);
+
+CREATE TABLE IF NOT EXISTS fix_counts (
+    run_id INTEGER NOT NULL REFERENCES fix_runs (run_id),
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS validation_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (session_id),
+    content_hash TEXT,
+    validated_at REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS validation_runs_session_id ON validation_runs (session_id);
+
+CREATE TABLE IF NOT EXISTS check_results (
+    run_id INTEGER NOT NULL REFERENCES validation_runs (run_id),
+    check_name TEXT NOT NULL,
+    violations INTEGER NOT NULL,
+    error TEXT,
+    seconds REAL,
+    PRIMARY KEY (run_id, check_name)
+);
+"""
+
+# directories in target_pickles.yml are named like 1172963963_604914_20220425
+session_dir_pattern = re.compile(r"(\d+)_(\d+)_(\d{4})(\d{2})(\d{2})")
+
+
+class SessionInfo(NamedTuple):
+    session_id: str
+    mouse_id: Optional[str]
+    # iso date, eg: 2022-04-25
+    date: Optional[str]
+
+
+def parse_session_path(path: str) -> SessionInfo:
+    """Parses the session id, mouse id and date of a session from its
+    directory or pickle path
+
+    Notes
+    -----
+    - the last path component starting with <session id>_<mouse id>_<date>
+    is used, paths without one are their own session id
+    """
+    for part in reversed(re.split(r"[\\/]+", path)):
+        match = session_dir_pattern.match(part)
+        if match is not None:
+            session_id, mouse_id, year, month, day = match.groups()
+            return SessionInfo(
+                session_id, mouse_id, "%s-%s-%s" % (year, month, day, ))
+    return SessionInfo(path, None, None)
+
+
+def open_catalog(path: str) -> sqlite3.Connection:
+    """Opens the catalog at `path`, creating it if it doesnt exist
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+    return connection
+
+
+def upsert_session(
+    connection: sqlite3.Connection,
+    pickle_path: str,
+    content_hash: Optional[str] = None,
+) -> str:
+    """Notes
+    -----
+    - a `content_hash` of None keeps the hash already recorded
+    """
+    session = parse_session_path(pickle_path)
+    connection.execute(
+        """
+        INSERT INTO sessions (session_id, mouse_id, date, pickle_path, content_hash, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (session_id) DO UPDATE SET
+            pickle_path = excluded.pickle_path,
+            content_hash = COALESCE(excluded.content_hash, sessions.content_hash),
+            updated_at = excluded.updated_at
+        """,
+        (
+            session.session_id,
+            session.mouse_id,
+            session.date,
+            pickle_path,
+            content_hash,
+            time.time(),
+        ),
+    )
+    return session.session_id
+
+
+def record_fix(
+    connection: sqlite3.Connection,
+    pickle_path: str,
+    fix_version: str,
+    content_hash: Optional[str] = None,
+    writer: Optional[str] = None,
+    output_mode: Optional[str] = None,
+    output_path: Optional[str] = None,
+    output_hash: Optional[str] = None,
+    error: Optional[str] = None,
+    counts: Optional[Dict[str, int]] = None,
+) -> int:
+    session_id = upsert_session(connection, pickle_path, content_hash)
+    cursor = connection.execute(
+        """
+        INSERT INTO fix_runs (
+            session_id, content_hash, fixed_at, fix_version, writer,
+            output_mode, output_path, output_hash, error
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            session_id,
+            content_hash,
+            time.time(),
+            fix_version,
+            writer,
+            output_mode,
+            output_path,
+            output_hash,
+            error,
+        ),
+    )
+    run_id = cursor.lastrowid
+    connection.executemany(
+        "INSERT INTO fix_counts (run_id, name, count) VALUES (?, ?, ?)",
+        [(run_id, name, count, ) for name, count in (counts or {}).items()],
+    )
+    return run_id
+
+
+def record_validation(
+    connection: sqlite3.Connection,
+    pickle_path: str,
+    records: List[Dict],
+    content_hash: Optional[str] = None,
+) -> int:
+    """Records the report records of `validate_pickles` for a pickle
+
+    Notes
+    -----
+    - a record with a check of None is a pickle that failed to load
+    """
+    session_id = upsert_session(connection, pickle_path, content_hash)
+    errors = [record["error"] for record in records if record["check"] is None]
+    cursor = connection.execute(
+        """
+        INSERT INTO validation_runs (session_id, content_hash, validated_at, error)
+        VALUES (?, ?, ?, ?)
+        """,
+        (
+            session_id,
+            content_hash,
+            time.time(),
+            errors[0] if len(errors) > 0 else None,
+        ),
+    )
+    run_id = cursor.lastrowid
+    connection.executemany(
+        """
+        INSERT INTO check_results (run_id, check_name, violations, error, seconds)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                run_id,
+                record["check"],
+                len(record["violations"]),
+                record["error"],
+                record["seconds"],
+            )
+            for record in records
+            if record["check"] is not None
+        ],
+    )
+    return run_id
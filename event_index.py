@@ -0,0 +1,59 @@
+from itertools import chain
+from typing import Dict, List, Sequence
+
+from records import EVENT_NAME
+
+
+class EventIndex:
+    """Groups the events of a trial log entry by event name, so a trial can be
+    queried for several event names without rescanning its events each time
+
+    Notes
+    -----
+    - built in a single pass over the events
+    - lookups are by name prefix like `filter_events`, they only scan the
+    distinct event names of the trial, which are far fewer than its events
+    - returned lists are cached and shared between calls, dont mutate them
+    """
+    __slots__ = ("events", "positions", "prefix_cache", )
+
+    def __init__(self, events: Sequence[list]):
+        self.events = events
+        positions: Dict[str, List[int]] = {}
+        for position, event in enumerate(events):
+            name = event[EVENT_NAME]
+            if name in positions:
+                positions[name].append(position)
+            else:
+                positions[name] = [position, ]
+        self.positions = positions
+        self.prefix_cache: Dict[str, list] = {}
+
+    @classmethod
+    def from_trial(cls, trial: dict) -> "EventIndex":
+        return cls(trial["events"])
+
+    def filter(self, prefix: str) -> list:
+        """Events whose name starts with `prefix`, in the order they occur in
+        the trial
+        """
+        try:
+            return self.prefix_cache[prefix]
+        except KeyError:
+            pass
+
+        matching = [
+            positions for name, positions in self.positions.items()
+            if name.startswith(prefix)
+        ]
+        if len(matching) == 1:
+            positions = matching[0]
+        else:
+            positions = sorted(chain.from_iterable(matching))
+
+        filtered = [self.events[position] for position in positions]
+        self.prefix_cache[prefix] = filtered
+        return filtered
+
+    def has(self, prefix: str) -> bool:
+        return len(self.filter(prefix)) > 0
@@ -1,16 +1,33 @@
 import os
 import pickle
 import copy
-from typing import Dict
-import logging
+import gzip
+import bz2
+import lzma
+import shutil
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import IO, Callable, Dict, List, NamedTuple, Optional, Tuple
 import uuid
 
+import numpy as np
 
-logger = logging.getLogger(__name__)
-
-transaction_log_path = f"{str(uuid.uuid4())}.log"
-logger.addHandler(logging.FileHandler(transaction_log_path))
-logger.setLevel(logging.DEBUG)
+from event_index import EventIndex
+from lazy_pickle import open_compressed
+from manifest import HashingReader, hash_file
+from records import CHANGE_FRAME, CHANGE_FROM_IMAGE, CHANGE_TIME, \
+    CHANGE_TO_IMAGE, EVENT_DESCRIPTION, EVENT_FRAME, EVENT_NAME, EVENT_TIME, \
+    IMAGE_NAME, IMAGE_PARAMS, LICK_TIME, Lick, encode_image_name, \
+    encode_image_params, fixed_image_name
+from split_storage import SplitPickler, SplitUnpickler, arrays_dir, \
+    default_min_bytes, remove_stale_sidecars, sidecar_filename
+from session_tables import SessionTables, ImageTransitions, LICK_EARLY, \
+    LICK_WITHIN, code_flag
+from transaction_log import logger, transaction
 
 
 def is_faux_catch(trial: Dict) -> bool:
@@ -21,9 +38,13 @@ def is_faux_catch(trial: Dict) -> bool:
     - Intends to classify a trial as a "faux catch" if the trial is a catch
     trial but the image changes to a new image
     """
-    return trial["trial_params"]["catch"] is True and \
-        len(trial["stimulus_changes"]
-            ) > 0 and trial["stimulus_changes"][0][0][0] != trial["stimulus_changes"][0][1][0]
+    if trial["trial_params"]["catch"] is not True or \
+            len(trial["stimulus_changes"]) < 1:
+        return False
+
+    stimulus_change = trial["stimulus_changes"][0]
+    return stimulus_change[CHANGE_FROM_IMAGE][IMAGE_NAME] != \
+        stimulus_change[CHANGE_TO_IMAGE][IMAGE_NAME]
 
 
 def is_faux_go(trial: Dict, prev_image_name: str) -> bool:
@@ -40,10 +61,12 @@ def is_faux_go(trial: Dict, prev_image_name: str) -> bool:
     if len(trial["stimulus_changes"]) < 1:
         return False
 
-    if trial["stimulus_changes"][0][0][0] != trial["stimulus_changes"][0][1][0]:
+    stimulus_change = trial["stimulus_changes"][0]
+    to_name = stimulus_change[CHANGE_TO_IMAGE][IMAGE_NAME]
+    if stimulus_change[CHANGE_FROM_IMAGE][IMAGE_NAME] != to_name:
         return False
 
-    return trial["stimulus_changes"][0][1][0] == prev_image_name
+    return to_name == prev_image_name
 
 
 def list_to_contiguous_pairs(l):
@@ -51,19 +74,23 @@ def list_to_contiguous_pairs(l):
         yield l[i:i+2]
 
 
-def encode_image_name(image_name: str, contrast: int) -> str:
-    """Serializes image params as a string image name
+def get_initial_image(data: Dict) -> str:
+    return encode_image_params(
+        data["items"]["behavior"]["params"]["initial_image_params"])
+
+
+def relabel_events(events: list, labels: Dict[str, str]) -> list:
+    """Renames events in an event log
 
     Notes
     -----
-    - Downstream code expects a string image name
+    - relabeled events are new lists, the rest are shared with the event log
+    passed in
     """
-    return f"{image_name}-{contrast}"
-
-
-def get_initial_image(data: Dict) -> str:
-    initial_params = data["items"]["behavior"]["params"]["initial_image_params"]
-    return encode_image_name(initial_params["Image"], initial_params["contrast"])
+    return [
+        [labels[event[EVENT_NAME]], ] + event[1:] if event[EVENT_NAME] in labels else event
+        for event in events
+    ]
 
 
 def fix_faux_catch_trial(trial: Dict) -> Dict:
@@ -75,25 +102,20 @@ def fix_faux_catch_trial(trial: Dict) -> Dict:
     - Relabels these trials as go trials
     - changes event labels in the event log to reflect what they should be 
     for a go trial
+    - doesnt mutate the trial passed in, fields that arent fixed are shared
+    with it
     """
-    fixed = copy.deepcopy(trial)
-    fixed["trial_params"]["catch"] = False
-    fixed_events = []
-    for event in fixed["events"]:
-        if event[0] == "sham_change":
-            event[0] = "change"
-        elif event[0] == "rejection":
-            event[0] = "miss"
-        elif event[0] == "false_alarm":
-            event[0] = "hit"
-            fixed["has_omitted_reward"] = len(fixed["rewards"]) > 0 and \
-                len(list(
-                    filter(lambda event: event[0] == "auto_reward", fixed["events"]))) == 0
-        else:
-            pass
-        fixed_events.append(event)
-
-    fixed["events"] = fixed_events
+    fixed = dict(trial)
+    fixed["trial_params"] = dict(trial["trial_params"], catch=False)
+    fixed["events"] = relabel_events(trial["events"], {
+        "sham_change": "change",
+        "rejection": "miss",
+        "false_alarm": "hit",
+    })
+    if any(event[EVENT_NAME] == "false_alarm" for event in trial["events"]):
+        fixed["has_omitted_reward"] = len(fixed["rewards"]) > 0 and \
+            len(list(
+                filter(lambda event: event[EVENT_NAME] == "auto_reward", fixed["events"]))) == 0
 
     return fixed
 
@@ -108,22 +130,16 @@ def fix_faux_go_trial(trial: Dict) -> Dict:
     - Relabels these trials as catch trials
     - changes event labels in the event log to reflect what they should be 
     for a catch trial
+    - doesnt mutate the trial passed in, fields that arent fixed are shared
+    with it
     """
-    fixed = copy.deepcopy(trial)
-    fixed["trial_params"]["catch"] = True
-    fixed_events = []
-    for event in fixed["events"]:
-        if event[0] == "change":
-            event[0] = "sham_change"
-        elif event[0] == "miss":
-            event[0] = "rejection"
-        elif event[0] == "hit":
-            event[0] = "false_alarm"
-        else:
-            pass
-        fixed_events.append(event)
-
-    fixed["events"] = fixed_events
+    fixed = dict(trial)
+    fixed["trial_params"] = dict(trial["trial_params"], catch=True)
+    fixed["events"] = relabel_events(trial["events"], {
+        "change": "sham_change",
+        "miss": "rejection",
+        "hit": "false_alarm",
+    })
 
     return fixed
 
@@ -133,10 +149,14 @@ def overwrite_prev_image(trial: Dict, new_image: str) -> None:
     """
     stimulus_change = trial["stimulus_changes"][0]
     trial["stimulus_changes"][0] = (
-        (new_image, new_image, ), stimulus_change[1], stimulus_change[2], stimulus_change[3])
+        (new_image, new_image, ),
+        stimulus_change[CHANGE_TO_IMAGE],
+        stimulus_change[CHANGE_TIME],
+        stimulus_change[CHANGE_FRAME],
+    )
 
 
-def fix_trials_initial_image(data: Dict) -> Dict:
+def fix_trials_initial_image(data: Dict, copy_mode: str = "deep") -> Dict:
     """Fixes the initial image name of the stimulus change of each trial
 
     Notes
@@ -145,101 +165,19 @@ def fix_trials_initial_image(data: Dict) -> Dict:
     - some bad trials had the incorrect initial image name because a change
     that was scheduled never occurred
     """
-    fixed = copy.deepcopy(data)
-    prev = get_initial_image(data)
-    for trial in fixed["items"]["behavior"]["trial_log"]:
-        stimulus_changes = trial["stimulus_changes"]
-        if len(stimulus_changes) > 0:
-            if stimulus_changes[0][0][0] != prev:
-                overwrite_prev_image(trial, prev)
-            prev = stimulus_changes[0][1][0]
-        else:
-            pass
-    return fixed
-
-
-def fix_images(data: Dict) -> Dict:
-    fixed = copy.deepcopy(data)
-    images_params = fixed["items"]["behavior"]["stimuli"].pop("images-params")
-    fixed["items"]["behavior"]["stimuli"]["images"] = images_params
-    set_log = fixed["items"]["behavior"]["stimuli"]["images"]["set_log"]
-    # kinda vital since we're ignoring the first two and making some assumptions
-    assert set_log[0][3] == 0 and set_log[1][3] == 0
-    fixed_set_log = [
-        ("Image", get_initial_image(fixed), set_log[0][2], set_log[0][3], ),
-    ]
-
-    stim_groups = {}
-    for logs in list_to_contiguous_pairs(set_log[2:]):
-        assert logs[0][0] == "Image" and logs[1][0] == "contrast"
-        image_name = encode_image_name(logs[0][1], logs[1][1])
-        fixed_set_log.append(
-            ("Image", image_name, logs[0][2], logs[0][3], )
-        )
-        stim_groups[image_name] = [image_name, ]
+    return run_fix_passes(data, ["initial_image"], copy_mode=copy_mode)
 
-    fixed["items"]["behavior"]["stimuli"]["images"]["set_log"] = fixed_set_log
-    fixed["items"]["behavior"]["stimuli"]["images"]["stim_groups"] = stim_groups
-    fixed["items"]["behavior"]["stimuli"]["images"]["obj_type"] = "DoCImageStimulus"
-
-    for trial in fixed["items"]["behavior"]["trial_log"]:
-        stimulus_changes = trial["stimulus_changes"]
-        if len(trial["stimulus_changes"]) > 0:
-            # ensure its the shape were assuming it is
-            assert len(stimulus_changes) == 1
-            assert len(stimulus_changes[0]) == 4
-            assert len(stimulus_changes[0][0]) == 2
-            assert len(stimulus_changes[0][1]) == 2
-            from_image = encode_image_name(
-                stimulus_changes[0][0][1]["Image"],
-                stimulus_changes[0][0][1]["contrast"],
-            )
-            to_image = encode_image_name(
-                stimulus_changes[0][1][1]["Image"],
-                stimulus_changes[0][1][1]["contrast"],
-            )
-            trial["stimulus_changes"] = [
-                (
-                    (from_image, from_image, ),
-                    (to_image, to_image, ),
-                    stimulus_changes[0][2],
-                    stimulus_changes[0][3],
-                )
-            ]
 
-    return fixed
+def fix_images(data: Dict, copy_mode: str = "deep") -> Dict:
+    return run_fix_passes(data, ["images"], copy_mode=copy_mode)
 
 
-def fix_trials(data: Dict) -> Dict:
-    fixed = copy.deepcopy(data)
-    fixed_images = fix_images(fixed)
-    fixed_trial_log = []
-    initial_image_params = fixed["items"]["behavior"]["params"]["initial_image_params"]
-    prev_image_name = encode_image_name(
-        initial_image_params["Image"], initial_image_params["contrast"])
-    for trial in fixed_images["items"]["behavior"]["trial_log"]:
-        if trial["success"] is None:
-            pass
-        elif is_faux_go(trial, prev_image_name):
-            fixed_trial_log.append(
-                fix_faux_go_trial(trial)
-            )
-            logger.info("Fixed faux go trial at: %s" % trial["index"])
-        elif is_faux_catch(trial):
-            fixed_trial_log.append(
-                fix_faux_catch_trial(trial)
-            )
-            logger.info("Fixed faux catch trial at: %s" % trial["index"])
-        else:
-            fixed_trial_log.append(trial)
-
-        # in the weird situation where the first trial in a "success" is None trial
-        if len(fixed_trial_log) > 0 and len(fixed_trial_log[-1]["stimulus_changes"]) > 0:
-            prev_image_name = fixed_trial_log[-1]["stimulus_changes"][0][1][0]
-
-    fixed_images["items"]["behavior"]["trial_log"] = fixed_trial_log
-
-    return fixed_images
+def fix_trials(data: Dict, copy_mode: str = "deep") -> Dict:
+    return run_fix_passes(
+        data,
+        ["images", "success_none", "faux_trials"],
+        copy_mode=copy_mode,
+    )
 
 
 def filter_events(trial: dict, name_fiter: str) -> list:
@@ -247,7 +185,7 @@ def filter_events(trial: dict, name_fiter: str) -> list:
     """
     return [
         event for event in trial["events"]
-        if event[0].startswith(name_fiter)
+        if event[EVENT_NAME].startswith(name_fiter)
     ]
 
 
@@ -269,8 +207,8 @@ def fix_lick_disabled_trial_log(log) -> None:
     within_window_licks = list(filter(
         lambda event: lick_within_response_window(
             event,
-            response_window_events[0][3],
-            response_window_events[1][3],
+            response_window_events[0][EVENT_FRAME],
+            response_window_events[1][EVENT_FRAME],
         ),
         disabled_licks
     ))
@@ -286,17 +224,17 @@ def fix_lick_disabled_trial_log(log) -> None:
         fixed_events = []
         hit_added = False
         for event in log["events"]:
-            if event[0].startswith("miss"):
+            if event[EVENT_NAME].startswith("miss"):
                 continue
 
-            if event[3] == first_disabled_lick[3] and not hit_added:
-                if not event[0].startswith("licks disabled."):
+            if event[EVENT_FRAME] == first_disabled_lick[EVENT_FRAME] and not hit_added:
+                if not event[EVENT_NAME].startswith("licks disabled."):
                     continue
                 fixed_events.append([
                     "hit",
-                    first_disabled_lick[1],
-                    first_disabled_lick[2],
-                    first_disabled_lick[3],
+                    first_disabled_lick[EVENT_DESCRIPTION],
+                    first_disabled_lick[EVENT_TIME],
+                    first_disabled_lick[EVENT_FRAME],
                 ])
                 hit_added = True
             else:
@@ -360,188 +298,1296 @@ def is_early_lick(
     response_window_lower: float,
     stimulus_change_events: list,
 ) -> bool:
-    lick_time, _ = lick
+    lick_time = lick[LICK_TIME]
     if not lick_time < response_window_lower:
         return False
 
     # licks dont count as aborts if theyre before the response window but after
     # the stimulus change
     if len(stimulus_change_events) > 0:
-        return lick_time < stimulus_change_events[0][2]
+        return lick_time < stimulus_change_events[0][EVENT_TIME]
     else:
         return True
 
 
-def lick_disabled_event_to_lick(event):
-    assert event[0].startswith("licks disabled."), \
-        f"Unexpected event name: {event[0]}"
-    return event[2], event[3]
+def lick_disabled_event_to_lick(event) -> Lick:
+    assert event[EVENT_NAME].startswith("licks disabled."), \
+        f"Unexpected event name: {event[EVENT_NAME]}"
+    return (event[EVENT_TIME], event[EVENT_FRAME], )
 
 
-def classify_licks_no_reward_epoch(trial):
+def classify_licks_no_reward_epoch(trial, events: Optional[EventIndex] = None):
     """licks arent populated for "no_reward", they also have wierd event names
+
+    Notes
+    -----
+    - `events` is an index of the trial's events, built if not supplied
     """
-    response_window_events = filter_events(trial, "response_window")
-    lick_events = filter_events(trial, "licks disabled.")
+    if events is None:
+        events = EventIndex.from_trial(trial)
+    response_window_events = events.filter("response_window")
+    lick_events = events.filter("licks disabled.")
     licks = list(map(lick_disabled_event_to_lick, lick_events))
 
     if len(response_window_events) < 2:
-        abort_events = filter_events(trial, "abort")
+        abort_events = events.filter("abort")
         if len(abort_events) < 1:
             raise Exception("No response window but not aborted!")
         return licks, []
 
-    response_window_lower = response_window_events[0][2]
-    response_window_upper = response_window_events[1][2]
-    stimulus_change_events = filter_events(trial, "stimulus_changed")
+    response_window_lower = response_window_events[0][EVENT_TIME]
+    response_window_upper = response_window_events[1][EVENT_TIME]
+    stimulus_change_events = events.filter("stimulus_changed")
     early = list(filter(
         lambda lick: is_early_lick(
             lick, response_window_lower, stimulus_change_events),
         licks,
     ))
     within_window = list(filter(
-        lambda lick: response_window_lower < lick[0] < response_window_upper,
+        lambda lick: response_window_lower < lick[LICK_TIME] < response_window_upper,
         licks,
     ))
 
     return early, within_window
 
 
-def fix_no_reward_catch(log):
-    early, within_window = \
-        classify_licks_no_reward_epoch(log)
+def fix_no_reward_catch(
+    log,
+    events: Optional[EventIndex] = None,
+    licks: Optional[Tuple[list, list]] = None,
+):
+    """Notes
+    -----
+    - `licks` are the early and within window licks of the trial, classified
+    with `classify_licks_no_reward_epoch` if not supplied
+    """
+    if licks is None:
+        licks = classify_licks_no_reward_epoch(log, events)
+    early, within_window = licks
 
     if len(early) > 0:
         new_event_name = "early_response"
-        lick_time, _ = early[0]
+        lick_time = early[0][LICK_TIME]
     elif len(within_window) > 0:
         new_event_name = "false_alarm"
-        lick_time, _ = within_window[0]
+        lick_time = within_window[0][LICK_TIME]
     else:
         return
 
     fixed = []
     added_early_response = False
     for event in log["events"]:
-        if event[0].startswith("licks disabled.") and \
-                event[2] == lick_time and \
+        if event[EVENT_NAME].startswith("licks disabled.") and \
+                event[EVENT_TIME] == lick_time and \
                 not added_early_response:
             fixed.append(event)
             fixed.append([
                 new_event_name,
-                event[1],
-                event[2],
-                event[3],
+                event[EVENT_DESCRIPTION],
+                event[EVENT_TIME],
+                event[EVENT_FRAME],
             ])
             added_early_response = True
-        elif event[0].startswith("rejection"):
+        elif event[EVENT_NAME].startswith("rejection"):
             pass
         else:
             fixed.append(event)
     log["events"] = fixed
 
 
-def fix_no_reward_go(log):
-    early, within_window = \
-        classify_licks_no_reward_epoch(log)
+def fix_no_reward_go(
+    log,
+    events: Optional[EventIndex] = None,
+    licks: Optional[Tuple[list, list]] = None,
+):
+    """Notes
+    -----
+    - `licks` are the early and within window licks of the trial, classified
+    with `classify_licks_no_reward_epoch` if not supplied
+    """
+    if licks is None:
+        licks = classify_licks_no_reward_epoch(log, events)
+    early, within_window = licks
 
     if len(early) > 0:
         new_event_name = "early_response"
-        lick_time, _ = early[0]
+        lick_time = early[0][LICK_TIME]
     elif len(within_window) > 0:
         new_event_name = "hit"
-        lick_time, _ = within_window[0]
+        lick_time = within_window[0][LICK_TIME]
     else:
         return
 
     fixed = []
     added_early_response = False
     for event in log["events"]:
-        if event[0].startswith("licks disabled.") and \
-                event[2] == lick_time and \
+        if event[EVENT_NAME].startswith("licks disabled.") and \
+                event[EVENT_TIME] == lick_time and \
                 not added_early_response:
             fixed.append(event)
             fixed.append([
                 new_event_name,
-                event[1],
-                event[2],
-                event[3],
+                event[EVENT_DESCRIPTION],
+                event[EVENT_TIME],
+                event[EVENT_FRAME],
             ])
             added_early_response = True
-        elif event[0].startswith("miss"):
+        elif event[EVENT_NAME].startswith("miss"):
             pass
         else:
             fixed.append(event)
     log["events"] = fixed
 
 
-def fix_lick_disabled_log(log):
-    if log["licks_enabled"]:
+def is_lick_disabled(trial: Dict) -> bool:
+    """Whether or not licks were disabled during a trial, shared by
+    `fix_lick_disabled_log` and the "lick_disabled" fix pass so they always
+    agree on which trials they fix
+
+    Notes
+    -----
+    - any falsy `licks_enabled` counts, not just False
+    """
+    return not trial["licks_enabled"]
+
+
+def fix_lick_disabled_log(log, licks: Optional[Tuple[list, list]] = None):
+    if not is_lick_disabled(log):
         return
 
+    # every check below looks up events, index them once
+    events = EventIndex.from_trial(log)
     is_catch = log["trial_params"]["catch"]
     if is_catch is True:
-        rejection_events = filter_events(log, "rejection")
+        rejection_events = events.filter("rejection")
         if len(rejection_events) < 1:
             return
 
-        fix_no_reward_catch(log)
+        fix_no_reward_catch(log, events, licks)
     elif is_catch is False:
-        miss_events = filter_events(log, "miss")
+        miss_events = events.filter("miss")
         if len(miss_events) < 1:
             return
 
-        fix_no_reward_go(log)
+        fix_no_reward_go(log, events, licks)
     else:
         raise Exception("Unexpected value for is_catch: %s" % is_catch)
 
 
-def fix_behavior_pickle(pickle_path: str, output_dir: str) -> str:
+def has_images_params(data: Dict) -> bool:
+    return "images-params" in data["items"]["behavior"]["stimuli"]
+
+
+def has_lick_disabled_trials(data: Dict) -> bool:
+    return any(
+        is_lick_disabled(trial)
+        for trial in data["items"]["behavior"]["trial_log"]
+    )
+
+
+def fix_images_stimuli(data: Dict, state: Dict) -> None:
+    """mutates object passed in
+    """
+    stimuli = data["items"]["behavior"]["stimuli"]
+    images_params = dict(stimuli.pop("images-params"))
+    stimuli["images"] = images_params
+    set_log = images_params["set_log"]
+    # kinda vital since we're ignoring the first two and making some assumptions
+    assert set_log[0][3] == 0 and set_log[1][3] == 0
+    fixed_set_log = [
+        ("Image", get_initial_image(data), set_log[0][2], set_log[0][3], ),
+    ]
+
+    stim_groups = {}
+    for logs in list_to_contiguous_pairs(set_log[2:]):
+        assert logs[0][0] == "Image" and logs[1][0] == "contrast"
+        image_name = encode_image_name(logs[0][1], logs[1][1])
+        fixed_set_log.append(
+            ("Image", image_name, logs[0][2], logs[0][3], )
+        )
+        stim_groups[image_name] = [image_name, ]
+
+    images_params["set_log"] = fixed_set_log
+    images_params["stim_groups"] = stim_groups
+    images_params["obj_type"] = "DoCImageStimulus"
+    logger.info(
+        "Renamed images-params stimuli to images",
+        extra=transaction(state["session"], "images"))
+
+
+def fix_images_stimulus_changes(trial: Dict, state: Dict) -> Dict:
+    stimulus_changes = trial["stimulus_changes"]
+    if len(stimulus_changes) > 0:
+        # ensure its the shape were assuming it is
+        assert len(stimulus_changes) == 1
+        assert len(stimulus_changes[0]) == 4
+        assert len(stimulus_changes[0][CHANGE_FROM_IMAGE]) == 2
+        assert len(stimulus_changes[0][CHANGE_TO_IMAGE]) == 2
+        stimulus_change = stimulus_changes[0]
+        from_image = encode_image_params(
+            stimulus_change[CHANGE_FROM_IMAGE][IMAGE_PARAMS])
+        to_image = encode_image_params(
+            stimulus_change[CHANGE_TO_IMAGE][IMAGE_PARAMS])
+        trial = dict(trial)
+        trial["stimulus_changes"] = [
+            (
+                (from_image, from_image, ),
+                (to_image, to_image, ),
+                stimulus_change[CHANGE_TIME],
+                stimulus_change[CHANGE_FRAME],
+            ),
+        ]
+    return trial
+
+
+def drop_success_none_trial(trial: Dict, state: Dict) -> Optional[Dict]:
+    if trial["success"] is None:
+        logger.info(
+            "Dropped success None trial at: %s", trial["index"],
+            extra=transaction(state["session"], "success_none", trial["index"]))
+        return None
+    return trial
+
+
+def sequenced_trials(data: Dict, state: Dict) -> List[Dict]:
+    """The trials a pass that runs before the trial log is traversed sees in
+    the image sequence, the ones still in the trial log when the pass fixes
+    them
+
+    Notes
+    -----
+    - trials with "success": None are left out only if the success_none pass
+    runs before this one in the same run, on its own a pass sees every trial
+    like the baseline fixes did
+    """
+    trials = data["items"]["behavior"]["trial_log"]
+    if "success_none" not in state["passes_before"]:
+        return trials
+    return [trial for trial in trials if trial["success"] is not None]
+
+
+def classify_faux_trials(data: Dict, state: Dict) -> None:
+    """Finds the faux go and faux catch trials of a session at once, for
+    `fix_faux_trial`
+
+    Notes
+    -----
+    - vectorized `is_faux_go` and `is_faux_catch` over the image transitions
+    of the session
+    - images are compared by the names `fix_images` gives them, so it doesnt
+    matter if the images pass ran before this one
+    - see `sequenced_trials` for the trials in the image sequence
+    """
+    trials = sequenced_trials(data, state)
+    transitions = ImageTransitions.from_trials(
+        trials, get_initial_image(data), fixed_image_name)
+    catch = np.array([
+        code_flag(trial["trial_params"]["catch"]) for trial in trials
+    ], dtype=np.int8)
+    has_change = transitions.has_change()
+    same_image = transitions.from_image == transitions.to_image
+    faux_go = (catch != 1) & has_change & same_image & \
+        (transitions.to_image == transitions.prev_image)
+    faux_catch = (catch == 1) & has_change & ~same_image
+    state["faux_go"] = set(transitions.index[faux_go].tolist())
+    state["faux_catch"] = set(transitions.index[faux_catch].tolist())
+
+
+def fix_faux_trial(trial: Dict, state: Dict) -> Dict:
+    if trial["index"] in state["faux_go"]:
+        trial = fix_faux_go_trial(trial)
+        state["counts"]["faux_go_trials"] += 1
+        logger.info(
+            "Fixed faux go trial at: %s", trial["index"],
+            extra=transaction(state["session"], "faux_go", trial["index"]))
+    elif trial["index"] in state["faux_catch"]:
+        trial = fix_faux_catch_trial(trial)
+        state["counts"]["faux_catch_trials"] += 1
+        logger.info(
+            "Fixed faux catch trial at: %s", trial["index"],
+            extra=transaction(state["session"], "faux_catch", trial["index"]))
+    return trial
+
+
+def find_initial_image_mismatches(data: Dict, state: Dict) -> None:
+    """Finds the trials whose change doesnt start from the image that was
+    shown, for `fix_trial_initial_image`
+
+    Notes
+    -----
+    - runs before the trial log is traversed, so like `classify_faux_trials`
+    images are compared by the names `fix_images` gives them and the image
+    sequence is the one of `sequenced_trials`, the result is the same as
+    fixing the trials the earlier passes already fixed
+    """
+    trials = sequenced_trials(data, state)
+    transitions = ImageTransitions.from_trials(
+        trials, get_initial_image(data), fixed_image_name)
+    mismatches = transitions.initial_image_mismatches()
+    state["initial_images"] = {
+        index: transitions.image_names[code]
+        for index, code in zip(
+            transitions.index[mismatches].tolist(),
+            transitions.prev_image[mismatches].tolist(),
+        )
+    }
+
+
+def fix_trial_initial_image(trial: Dict, state: Dict) -> Dict:
+    if trial["index"] in state["initial_images"]:
+        trial = dict(trial, stimulus_changes=list(trial["stimulus_changes"]))
+        overwrite_prev_image(trial, state["initial_images"][trial["index"]])
+        logger.info(
+            "Fixed initial image of trial at: %s", trial["index"],
+            extra=transaction(state["session"], "initial_image", trial["index"]))
+    return trial
+
+
+def to_licks(licks: np.ndarray) -> List[Lick]:
+    return list(zip(licks["time"].tolist(), licks["frame"].tolist()))
+
+
+def classify_lick_disabled_licks(data: Dict, state: Dict) -> None:
+    """Classifies the licks of every licks disabled trial at once, for
+    `fix_lick_disabled_trial`
+
+    Notes
+    -----
+    - the events the classification reads arent changed by any other pass so
+    it can be done before the trial log is traversed
+    - trials with neither a response window nor an abort are left out,
+    `classify_licks_no_reward_epoch` raises for them if theyre fixed
+    """
+    trials = [
+        trial for trial in data["items"]["behavior"]["trial_log"]
+        if is_lick_disabled(trial)
+    ]
+    tables = SessionTables.from_trials(trials)
+    windows = tables.response_windows()
+    licks = tables.disabled_licks()
+    labels = tables.lick_labels(licks, windows)
+    # licks are grouped by trial row
+    bounds = np.searchsorted(licks["trial"], np.arange(len(trials) + 1))
+
+    classified = {}
+    for row, trial in enumerate(trials):
+        if not windows.has_window[row] and not windows.aborted[row]:
+            continue
+        trial_licks = licks[bounds[row]:bounds[row + 1]]
+        trial_labels = labels[bounds[row]:bounds[row + 1]]
+        classified[trial["index"]] = (
+            to_licks(trial_licks[trial_labels == LICK_EARLY]),
+            to_licks(trial_licks[trial_labels == LICK_WITHIN]),
+        )
+    state["licks"] = classified
+
+
+def fix_lick_disabled_trial(trial: Dict, state: Dict) -> Dict:
+    if not is_lick_disabled(trial):
+        return trial
+
+    fixed = dict(trial)
+    fix_lick_disabled_log(fixed, state["licks"].get(trial["index"]))
+    if fixed["events"] is trial["events"]:
+        return trial
+    logger.info(
+        "Fixed lick disabled trial at: %s", trial["index"],
+        extra=transaction(state["session"], "lick_disabled", trial["index"]))
+    return fixed
+
+
+@dataclass(frozen=True)
+class FixPass:
+    """A fix applied to a behavior session by `run_fix_passes`
+
+    Notes
+    -----
+    - `reads` and `writes` document the paths the pass reads and writes,
+    relative to `items.behavior` with trial fields prefixed with "trial_log.".
+    Theyre documentation only, `run_fix_passes` doesnt check them, keep them
+    up to date when ordering passes so one doesnt read what an earlier one
+    wrote by mistake
+    - `fix_session` runs once before the trial log is traversed and can seed
+    `state`, it may only replace values in `items.behavior` and
+    `items.behavior.stimuli`
+    - `fix_trial` runs on each trial during the single traversal of the trial
+    log, it returns the trial to keep or None to drop it, `state` is private
+    to the pass and persists across trials
+    - `fix_trial` must not mutate the trial passed in, it returns a new dict
+    for a trial it changes and shares the fields it doesnt change
+    - `state["counts"]` is a Counter shared by every pass, for counts of
+    fixes reported in `FixMetrics`, `state["session"]` identifies the
+    session in the transaction log and `state["passes_before"]` are the names
+    of the passes that run before this one
+    - `applies` is checked against the unfixed session, passes that cannot
+    apply are skipped entirely
+    """
+    name: str
+    reads: Tuple[str, ...]
+    writes: Tuple[str, ...]
+    fix_session: Optional[Callable[[Dict, Dict], None]] = None
+    fix_trial: Optional[Callable[[Dict, Dict], Optional[Dict]]] = None
+    applies: Callable[[Dict], bool] = lambda data: True
+
+
+fix_passes: Dict[str, FixPass] = {}
+
+
+def register_fix_pass(fix_pass: FixPass) -> FixPass:
+    if fix_pass.name in fix_passes:
+        raise Exception("Fix pass already registered: %s" % fix_pass.name)
+    fix_passes[fix_pass.name] = fix_pass
+    return fix_pass
+
+
+register_fix_pass(FixPass(
+    name="images",
+    reads=(
+        "params.initial_image_params",
+        "stimuli.images-params",
+        "trial_log.stimulus_changes",
+    ),
+    writes=(
+        "stimuli.images-params",
+        "stimuli.images",
+        "trial_log.stimulus_changes",
+    ),
+    fix_session=fix_images_stimuli,
+    fix_trial=fix_images_stimulus_changes,
+    applies=has_images_params,
+))
+register_fix_pass(FixPass(
+    name="success_none",
+    reads=("trial_log.success", ),
+    writes=("trial_log", ),
+    fix_trial=drop_success_none_trial,
+))
+register_fix_pass(FixPass(
+    name="faux_trials",
+    reads=(
+        "params.initial_image_params",
+        "trial_log.success",
+        "trial_log.trial_params",
+        "trial_log.stimulus_changes",
+        "trial_log.events",
+        "trial_log.rewards",
+    ),
+    writes=(
+        "trial_log.trial_params",
+        "trial_log.events",
+        "trial_log.has_omitted_reward",
+    ),
+    fix_session=classify_faux_trials,
+    fix_trial=fix_faux_trial,
+))
+register_fix_pass(FixPass(
+    name="lick_disabled",
+    reads=(
+        "trial_log.licks_enabled",
+        "trial_log.trial_params",
+        "trial_log.events",
+    ),
+    writes=("trial_log.events", ),
+    fix_session=classify_lick_disabled_licks,
+    fix_trial=fix_lick_disabled_trial,
+    applies=has_lick_disabled_trials,
+))
+register_fix_pass(FixPass(
+    name="initial_image",
+    reads=(
+        "params.initial_image_params",
+        "trial_log.stimulus_changes",
+    ),
+    writes=("trial_log.stimulus_changes", ),
+    fix_session=find_initial_image_mismatches,
+    fix_trial=fix_trial_initial_image,
+))
+
+# passes applied by fix_behavior_pickle, in order
+default_fix_passes = ["images", "success_none", "faux_trials", "lick_disabled"]
+
+
+@dataclass
+class FixMetrics:
+    """Where the time and memory fixing a session goes
+
+    Notes
+    -----
+    - `stages` maps a stage name to its wall time in seconds and, if
+    `trace_memory` is True, the peak memory traced by tracemalloc while it
+    ran in bytes. Stages are "load", "fix", "write" and "fix.<pass name>" for
+    each fix pass, the passes are run in a single traversal so their time is
+    the sum of their calls
+    - `counts` are the number of trials, trials dropped, faux go and faux
+    catch trials fixed and events rewritten (relabeled, added or removed)
+    - tracing memory slows everything it traces down, several times over
+    """
+    trace_memory: bool = False
+    stages: Dict[str, Dict] = field(default_factory=dict)
+    counts: Counter = field(default_factory=Counter)
+
+    def to_dict(self) -> Dict:
+        return {
+            "stages": self.stages,
+            "counts": dict(self.counts),
+        }
+
+
+@contextmanager
+def measure_stage(metrics: Optional[FixMetrics], name: str):
+    if metrics is None:
+        yield
+        return
+
+    if metrics.trace_memory:
+        # restarted for each stage, tracemalloc.reset_peak is python 3.9+
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = None
+        if metrics.trace_memory:
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        metrics.stages[name] = {
+            "seconds": seconds,
+            "peak_bytes": peak_bytes,
+        }
+
+
+def count_changed_events(events: list, fixed_events: list) -> Tuple[int, int]:
+    """Counts the events a fix added to and removed from an event log
+
+    Returns
+    -------
+    number of events added
+    number of events removed
+
+    Notes
+    -----
+    - fixes share the events they dont change with the unfixed event log,
+    events are matched by identity. A relabeled event counts as one removed
+    and one added, like a miss swapped for a hit
+    """
+    event_ids = set(map(id, events))
+    fixed_event_ids = set(map(id, fixed_events))
+    added = sum(1 for event in fixed_events if id(event) not in event_ids)
+    removed = sum(1 for event in events if id(event) not in fixed_event_ids)
+    return added, removed
+
+
+# how run_fix_passes treats the session passed in
+#   deep: fixes a deep copy, the input is untouched and shares nothing with
+#     the output
+#   shared: the input is untouched, the output shares every trial and value
+#     that wasnt fixed with it
+#   inplace: mutates the input and returns it
+copy_modes = ("deep", "shared", "inplace", )
+
+
+def run_fix_passes(
+    data: Dict,
+    pass_names: List[str],
+    copy_mode: str = "inplace",
+    metrics: Optional[FixMetrics] = None,
+    session: Optional[str] = None,
+) -> Dict:
+    """Applies registered fix passes to a behavior session in a single
+    traversal of its trial log
+
+    Notes
+    -----
+    - passes are applied in the order given, for each trial every pass sees
+    the trial as left by the passes before it
+    - a trial dropped by a pass is not seen by the passes after it
+    - in "shared" and "inplace" mode only the trials that are changed are
+    copied, and only the fields that are changed are new objects
+    - if `metrics` is supplied the time of each pass and the fixes counts are
+    added to it
+    - `session` identifies the session in the transaction log records of the
+    fixes, usually the path of its pickle
+    """
+    if copy_mode == "deep":
+        data = copy.deepcopy(data)
+    elif copy_mode == "shared":
+        data = dict(data)
+        data["items"] = dict(data["items"])
+        data["items"]["behavior"] = dict(data["items"]["behavior"])
+        data["items"]["behavior"]["stimuli"] = dict(
+            data["items"]["behavior"]["stimuli"])
+    elif copy_mode != "inplace":
+        raise Exception("Unexpected copy mode: %s" % copy_mode)
+
+    active = []
+    for name in pass_names:
+        fix_pass = fix_passes[name]
+        if fix_pass.applies(data):
+            active.append(fix_pass)
+        else:
+            logger.debug(
+                "Skipping fix pass: %s", name, extra=transaction(session, name))
+
+    counts = metrics.counts if metrics is not None else Counter()
+    seconds = Counter()
+    trial_passes = []
+    for position, fix_pass in enumerate(active):
+        state = {
+            "counts": counts,
+            "session": session,
+            "passes_before": [
+                earlier.name for earlier in active[:position]
+            ],
+        }
+        if fix_pass.fix_session is not None:
+            start = time.perf_counter()
+            fix_pass.fix_session(data, state)
+            seconds[fix_pass.name] += time.perf_counter() - start
+        if fix_pass.fix_trial is not None:
+            trial_passes.append((fix_pass, state, ))
+
+    behavior = data["items"]["behavior"]
+    counts["trials"] += len(behavior["trial_log"])
+    if len(trial_passes) > 0:
+        timed = metrics is not None
+        fixed_trial_log = []
+        for trial in behavior["trial_log"]:
+            events = trial["events"]
+            for fix_pass, state in trial_passes:
+                if timed:
+                    start = time.perf_counter()
+                trial = fix_pass.fix_trial(trial, state)
+                if timed:
+                    seconds[fix_pass.name] += time.perf_counter() - start
+                if trial is None:
+                    counts["trials_dropped"] += 1
+                    break
+            else:
+                if trial["events"] is not events:
+                    added, removed = count_changed_events(
+                        events, trial["events"])
+                    counts["events_added"] += added
+                    counts["events_removed"] += removed
+                fixed_trial_log.append(trial)
+
+        behavior["trial_log"] = fixed_trial_log
+
+    if metrics is not None:
+        for fix_pass in active:
+            metrics.stages["fix.%s" % fix_pass.name] = {
+                "seconds": seconds[fix_pass.name],
+                "peak_bytes": None,
+            }
+
+    return data
+
+
+class OutputWriter(NamedTuple):
+    protocol: int
+    # appended to the name of the output pickle
+    suffix: str
+    open: Callable[[str, str], IO]
+
+
+output_writers: Dict[str, OutputWriter] = {
+    "protocol0": OutputWriter(0, "", open),
+    "binary": OutputWriter(pickle.HIGHEST_PROTOCOL, "", open),
+    "gzip": OutputWriter(
+        pickle.HIGHEST_PROTOCOL, ".gz", partial(gzip.open, compresslevel=6)),
+    "bz2": OutputWriter(pickle.HIGHEST_PROTOCOL, ".bz2", bz2.open),
+    "lzma": OutputWriter(pickle.HIGHEST_PROTOCOL, ".xz", lzma.open),
+}
+
+
+def open_pickle(path: str, mode: str = "rb") -> IO:
+    """Opens a pickle, decompressing it if its name ends with the suffix of a
+    compressed output writer
+    """
+    for writer in output_writers.values():
+        if writer.suffix and path.endswith(writer.suffix):
+            return writer.open(path, mode)
+    return open(path, mode)
+
+
+def load_behavior_pickle(pickle_path: str) -> Dict:
+    with open_pickle(pickle_path) as f:
+        return pickle.load(f, encoding="latin1")
+
+
+def load_hashed_behavior_pickle(pickle_path: str) -> Tuple[Dict, str]:
+    """Loads a behavior pickle like `load_behavior_pickle`, hashing it as its
+    read
+
+    Returns
+    -------
+    the session and the sha256 of the pickle file, the same as
+    `manifest.hash_file`, without reading the pickle twice
+    """
     with open(pickle_path, "rb") as f:
-        data = pickle.load(f, encoding="latin1")
+        reader = HashingReader(f)
+        data = pickle.load(
+            open_compressed(reader, pickle_path), encoding="latin1")
+        return data, reader.hexdigest()
 
-    logger.info("Fixing pickle at: %s" % pickle_path)
-    fixed = fix_trials(data)
-    for log in fixed["items"]["behavior"]["trial_log"]:
-        fix_lick_disabled_log(log)
 
-    output_path = os.path.join(
+def objects_equal(a, b) -> bool:
+    """Compares unpickled sessions, which can contain numpy arrays and nans
+    """
+    if type(a) is not type(b):
+        return False
+
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and \
+            all(objects_equal(value, b[key]) for key, value in a.items())
+
+    if isinstance(a, (list, tuple, )):
+        return len(a) == len(b) and \
+            all(objects_equal(x, y) for x, y in zip(a, b))
+
+    if hasattr(a, "__array__") and hasattr(a, "dtype"):
+        if a.shape != b.shape or a.dtype != b.dtype:
+            return False
+        try:
+            return np.array_equal(a, b, equal_nan=True)
+        except TypeError:  # equal_nan only works on numeric dtypes
+            return np.array_equal(a, b)
+
+    if a == b:
+        return True
+    # nan
+    return a != a and b != b
+
+
+def write_pickle(
+    obj,
+    output_path: str,
+    writer: str = "protocol0",
+    atomic: bool = False,
+    verify_roundtrip: bool = False,
+    pickler: Callable[..., pickle.Pickler] = pickle.Pickler,
+) -> None:
+    """Writes an object to a pickle with one of `output_writers`
+
+    Notes
+    -----
+    - `atomic` writes to a temporary file in the same directory and renames
+    it to `output_path`, so `output_path` is never a partially written pickle
+    - `verify_roundtrip` reloads the written pickle and checks it equals `obj`,
+    if it doesnt an Exception is raised and nothing is left at `output_path`
+    - `pickler` is called with the file and protocol to pickle `obj` with
+    """
+    output_writer = output_writers[writer]
+    if atomic:
+        # not tempfile.mkstemp, its files are only readable by their owner
+        write_path = os.path.join(
+            os.path.dirname(output_path),
+            ".%s.%s.tmp" % (os.path.basename(output_path), uuid.uuid4().hex, ),
+        )
+    else:
+        write_path = output_path
+
+    try:
+        with output_writer.open(write_path, "wb") as f:
+            pickler(f, protocol=output_writer.protocol).dump(obj)
+
+        if verify_roundtrip:
+            with output_writer.open(write_path, "rb") as f:
+                reloaded = pickle.load(f, encoding="latin1")
+            if not objects_equal(obj, reloaded):
+                raise Exception(
+                    "Reloaded pickle doesnt equal the object written. output_path=%s" % output_path)
+
+        if atomic:
+            os.replace(write_path, output_path)
+    except BaseException:
+        if os.path.exists(write_path):
+            os.remove(write_path)
+        raise
+
+
+# bump whenever the layout of patches changes
+patch_version = 1
+
+patch_suffix = ".patch"
+
+split_suffix = ".split"
+
+# what fix_behavior_pickle writes
+#   pickle: the whole fixed session
+#   patch: only what the fixes changed, see make_patch
+#   split: the large arrays to .npy sidecars and the rest to a small pickle,
+#   see write_split_pickle
+output_modes = ("pickle", "patch", "split", )
+
+
+def make_patch(data: Dict, fixed: Dict) -> Dict:
+    """Makes a patch that turns a session into its fixed version
+
+    Notes
+    -----
+    - `fixed` must share every value that wasnt fixed with `data`, like the
+    output of `run_fix_passes` in "shared" copy mode, values are compared by
+    identity
+    - trials are identified by their "index", the patch holds the indices of
+    dropped trials and the fields of the trials that were changed
+    - values in `items.behavior` and `items.behavior.stimuli` that were
+    replaced or removed are recorded, eg: "images-params" renamed to "images"
+    """
+    behavior = data["items"]["behavior"]
+    fixed_behavior = fixed["items"]["behavior"]
+
+    fixed_trials = {
+        trial["index"]: trial for trial in fixed_behavior["trial_log"]
+    }
+    dropped_trials = []
+    trials = {}
+    for trial in behavior["trial_log"]:
+        fixed_trial = fixed_trials.get(trial["index"])
+        if fixed_trial is None:
+            dropped_trials.append(trial["index"])
+        elif fixed_trial is not trial:
+            trials[trial["index"]] = {
+                key: value for key, value in fixed_trial.items()
+                if key not in trial or trial[key] is not value
+            }
+
+    def changed(values: Dict, fixed_values: Dict, ignore: Tuple[str, ...] = ()) -> Tuple[Dict, List[str]]:
+        replaced = {
+            key: value for key, value in fixed_values.items()
+            if key not in ignore and
+            (key not in values or values[key] is not value)
+        }
+        removed = [key for key in values if key not in fixed_values]
+        return replaced, removed
+
+    behavior_values, removed_behavior = changed(
+        behavior, fixed_behavior, ("trial_log", "stimuli", ))
+    stimuli, removed_stimuli = changed(
+        behavior["stimuli"], fixed_behavior["stimuli"])
+
+    return {
+        "patch_version": patch_version,
+        "dropped_trials": dropped_trials,
+        "trials": trials,
+        "behavior": behavior_values,
+        "removed_behavior": removed_behavior,
+        "stimuli": stimuli,
+        "removed_stimuli": removed_stimuli,
+    }
+
+
+def apply_patch(data: Dict, patch: Dict) -> Dict:
+    """Applies a patch made by `make_patch` to the session it was made from
+
+    Notes
+    -----
+    - mutates the session passed in, the fixed fields of patched trials are
+    shared with the patch
+    """
+    if patch["patch_version"] != patch_version:
+        raise Exception(
+            "Unexpected patch version: %s" % patch["patch_version"])
+
+    behavior = data["items"]["behavior"]
+    dropped_trials = set(patch["dropped_trials"])
+    trial_log = []
+    for trial in behavior["trial_log"]:
+        if trial["index"] in dropped_trials:
+            continue
+        if trial["index"] in patch["trials"]:
+            trial = dict(trial, **patch["trials"][trial["index"]])
+        trial_log.append(trial)
+    behavior["trial_log"] = trial_log
+
+    for key in patch["removed_behavior"]:
+        del behavior[key]
+    behavior.update(patch["behavior"])
+
+    stimuli = behavior["stimuli"]
+    for key in patch["removed_stimuli"]:
+        del stimuli[key]
+    stimuli.update(patch["stimuli"])
+
+    return data
+
+
+def load_patched_pickle(pickle_path: str, patch_path: str) -> Dict:
+    """Loads a behavior pickle with a patch written by `fix_behavior_pickle`
+    applied to it
+
+    Notes
+    -----
+    - raises if the pickle changed since the patch was made from it
+    """
+    with open_pickle(patch_path) as f:
+        patch = pickle.load(f)
+    data, input_hash = load_hashed_behavior_pickle(pickle_path)
+    if input_hash != patch["input_hash"]:
+        raise Exception(
+            "Pickle changed since the patch was made. pickle_path=%s, patch_path=%s" % (
+                pickle_path, patch_path, ))
+    return apply_patch(data, patch)
+
+
+def write_split_pickle(
+    obj,
+    output_path: str,
+    writer: str = "protocol0",
+    atomic: bool = False,
+    verify_roundtrip: bool = False,
+    min_bytes: int = default_min_bytes,
+) -> None:
+    """Writes a session split in two, its arrays of at least `min_bytes` to
+    .npy sidecars in `split_storage.arrays_dir(output_path)` and everything
+    else, trial log included, to a skeleton pickle at `output_path`
+
+    Notes
+    -----
+    - the skeleton and sidecars are written to a temporary directory next to
+    the arrays directory, with a `split_storage.SplitPickler` writing the
+    sidecars as the skeleton is pickled. Only once theyre all written (and
+    verified) are the sidecars renamed into the arrays directory and then
+    the skeleton to `output_path`, so a failed split leaves the earlier one
+    untouched and nothing behind. Renames are atomic so `atomic` changes
+    nothing, its accepted like `write_pickle` does
+    - the skeleton is written with the highest protocol even if `writer` is
+    "protocol0", only `load_split_pickle` reads it
+    - sidecars are overwritten when a session is split again, the ones left
+    over from a split with more arrays are removed once the skeleton is
+    renamed
+    - `verify_roundtrip` reloads the skeleton and sidecars and checks they
+    equal `obj`, if they dont an Exception is raised
+    """
+    directory = arrays_dir(output_path)
+    os.makedirs(directory, exist_ok=True)
+    # not tempfile.mkdtemp, its directories are only readable by their owner
+    write_directory = os.path.join(
+        os.path.dirname(directory),
+        ".%s.%s.tmp" % (os.path.basename(directory), uuid.uuid4().hex, ),
+    )
+    os.mkdir(write_directory)
+    # named like the output so its opened with the same decompressor
+    write_path = os.path.join(write_directory, os.path.basename(output_path))
+    if writer == "protocol0":
+        writer = "binary"
+    picklers = []
+
+    def make_pickler(file: IO, protocol: int) -> SplitPickler:
+        split_pickler = SplitPickler(
+            file,
+            write_directory,
+            protocol=protocol,
+            min_bytes=min_bytes,
+        )
+        picklers.append(split_pickler)
+        return split_pickler
+
+    try:
+        write_pickle(obj, write_path, writer=writer, pickler=make_pickler)
+        n_sidecars = picklers[-1].n_sidecars
+
+        if verify_roundtrip:
+            with open_pickle(write_path) as f:
+                reloaded = SplitUnpickler(f, write_directory, None).load()
+            if not objects_equal(obj, reloaded):
+                raise Exception(
+                    "Reloaded split pickle doesnt equal the object written. output_path=%s" % output_path)
+
+        for n in range(n_sidecars):
+            filename = sidecar_filename(n)
+            os.replace(
+                os.path.join(write_directory, filename),
+                os.path.join(directory, filename),
+            )
+        os.replace(write_path, output_path)
+    finally:
+        shutil.rmtree(write_directory, ignore_errors=True)
+    remove_stale_sidecars(directory, n_sidecars)
+
+
+def load_split_pickle(
+    skeleton_path: str,
+    mmap_mode: Optional[str] = "r",
+    load_arrays: bool = True,
+) -> Dict:
+    """Loads a session written by `write_split_pickle`
+
+    Notes
+    -----
+    - arrays are memory mapped with `mmap_mode`, pass None to read them into
+    memory
+    - if `load_arrays` is False the arrays are left as
+    `split_storage.ArraySidecar` placeholders, for readers that only need the
+    trial log
+    """
+    with open_pickle(skeleton_path) as f:
+        if not load_arrays:
+            return pickle.load(f)
+        return SplitUnpickler(f, arrays_dir(skeleton_path), mmap_mode).load()
+
+
+def write_output(obj, output_path: str, output_mode: str = "pickle", **kwargs) -> None:
+    """Writes the output of `fix_loaded_pickle`, kwargs are passed to
+    `write_pickle` or `write_split_pickle`
+    """
+    if output_mode == "split":
+        write_split_pickle(obj, output_path, **kwargs)
+    else:
+        write_pickle(obj, output_path, **kwargs)
+
+
+def fix_hashed_behavior_pickle(
+    pickle_path: str,
+    output_dir: str,
+    copy_mode: str = "inplace",
+    writer: str = "protocol0",
+    atomic: bool = False,
+    verify_roundtrip: bool = False,
+    metrics: Optional[FixMetrics] = None,
+    output_mode: str = "pickle",
+    verify_checks: bool = False,
+) -> Tuple[str, str]:
+    """Fixes a behavior pickle and writes the fixed session to `output_dir`
+
+    Returns
+    -------
+    the path the fixed session was written to and the sha256 of the pickle,
+    hashed as it was loaded
+
+    Notes
+    -----
+    - `copy_mode` is passed to `run_fix_passes`, the loaded session isnt
+    shared with anything so "inplace" is safe and the cheapest
+    - with "inplace" or "shared" peak memory stays close to one copy of the
+    loaded session, the only extra allocations are the new trial log list
+    and the fixed fields of the trials that change. "deep" needs a second full
+    copy of the session
+    - `writer`, `atomic` and `verify_roundtrip` are passed to `write_pickle`,
+    the output name is the name of the input plus the suffix of the writer
+    - if `metrics` is supplied the time and memory of each stage and the
+    fixes counts are recorded in it
+    - with `output_mode` "patch" only a patch of the fixes is written, named
+    like the input plus ".patch" and the suffix of the writer, and the fixes
+    are run in "shared" copy mode whatever `copy_mode` is. Load the fixed
+    session with `load_patched_pickle`
+    - with `output_mode` "split" the fixed session is written with
+    `write_split_pickle`, named like the input plus ".split" and the suffix of
+    the writer. Load it with `load_split_pickle`
+    - `verify_checks` is passed to `fix_loaded_pickle`, a session that fails
+    the checks isnt written
+    """
+    with measure_stage(metrics, "load"):
+        data, input_hash = load_hashed_behavior_pickle(pickle_path)
+
+    fixed, output_path = fix_loaded_pickle(
+        pickle_path,
+        data,
         output_dir,
-        os.path.basename(pickle_path),
+        copy_mode=copy_mode,
+        writer=writer,
+        output_mode=output_mode,
+        metrics=metrics,
+        verify_checks=verify_checks,
+        input_hash=input_hash,
     )
-    with open(output_path, "wb") as f:
-        pickle.dump(fixed, f, protocol=0)
+    # dont hold on to the unfixed session while writing
+    del data
+
+    with measure_stage(metrics, "write"):
+        write_output(
+            fixed,
+            output_path,
+            output_mode,
+            writer=writer,
+            atomic=atomic,
+            verify_roundtrip=verify_roundtrip,
+        )
+
+    return output_path, input_hash
+
+
+def fix_behavior_pickle(pickle_path: str, output_dir: str, **kwargs) -> str:
+    """Fixes a behavior pickle with `fix_hashed_behavior_pickle`, returns the
+    path the fixed session was written to
+    """
+    return fix_hashed_behavior_pickle(pickle_path, output_dir, **kwargs)[0]
 
-    return output_path
+
+def verify_fixed_session(pickle_path: str, fixed: Dict) -> None:
+    """Runs the checks of tests/test_raw.py on a fixed session, raises if any
+    of them fail
+
+    Notes
+    -----
+    - the violations of each failed check are logged to the transaction log
+    - the checks are imported here, so fixing without verifying doesnt import
+    the test helpers and their dependencies
+    """
+    from tests.checks import CheckedSession, run_checks
+
+    failed = []
+    for result in run_checks(CheckedSession.from_raw(fixed)):
+        if result.error is not None:
+            logger.error(
+                "Check %s raised on fixed session: %s", result.check,
+                result.error, extra=transaction(pickle_path, "verify"))
+        elif len(result.violations) > 0:
+            logger.error(
+                "Fixed session failed check %s. Indices: %s", result.check,
+                result.violations, extra=transaction(pickle_path, "verify"))
+        else:
+            continue
+        failed.append(result.check)
+
+    if len(failed) > 0:
+        raise Exception(
+            "Fixed session failed checks: %s. pickle_path=%s" % (
+                ", ".join(failed), pickle_path, ))
+
+
+def fix_loaded_pickle(
+    pickle_path: str,
+    data: Dict,
+    output_dir: str,
+    copy_mode: str = "inplace",
+    writer: str = "protocol0",
+    output_mode: str = "pickle",
+    metrics: Optional[FixMetrics] = None,
+    verify_checks: bool = False,
+    input_hash: Optional[str] = None,
+) -> Tuple[Dict, str]:
+    """Fixes a session loaded from `pickle_path` for `fix_behavior_pickle`
+
+    Returns
+    -------
+    what to write, the fixed session or its patch, and the path to write it to
+
+    Notes
+    -----
+    - with `verify_checks` the fixed session is checked with
+    `verify_fixed_session` before anything is written
+    - patches record the `input_hash` of the pickle, its hashed if its not
+    passed in
+    """
+    if output_mode not in output_modes:
+        raise Exception("Unexpected output mode: %s" % output_mode)
+    if output_mode == "patch":
+        copy_mode = "shared"
+
+    logger.info(
+        "Fixing pickle at: %s", pickle_path, extra=transaction(pickle_path))
+    with measure_stage(metrics, "fix"):
+        fixed = run_fix_passes(
+            data,
+            default_fix_passes,
+            copy_mode=copy_mode,
+            metrics=metrics,
+            session=pickle_path,
+        )
+    if verify_checks:
+        with measure_stage(metrics, "verify"):
+            verify_fixed_session(pickle_path, fixed)
+    if output_mode == "patch":
+        if input_hash is None:
+            input_hash = hash_file(pickle_path)
+        fixed = dict(make_patch(data, fixed), input_hash=input_hash)
+        output_name = os.path.basename(pickle_path) + patch_suffix
+    elif output_mode == "split":
+        output_name = os.path.basename(pickle_path) + split_suffix
+    else:
+        output_name = os.path.basename(pickle_path)
+
+    output_path = os.path.join(
+        output_dir,
+        output_name + output_writers[writer].suffix,
+    )
+    return fixed, output_path
 
 
 if __name__ == "__main__":
+    import sys
     import yaml
-    import glob
     import argparse
 
+    from batch import FixResult, aggregate_metrics, catalog_fix_results, \
+        find_target_pickles, fix_behavior_pickles, \
+        fix_behavior_pickles_pipelined, print_metrics, print_summary, \
+        write_metrics
+    from manifest import load_manifest
+    from transaction_log import close_transaction_log, open_transaction_log
+    from watch import watch_behavior_pickles
+
     parser = argparse.ArgumentParser()
     parser.add_argument("target_pickle_list", type=str)
     parser.add_argument("output_dir", type=str)
+    parser.add_argument(
+        "--copy-mode", type=str, choices=copy_modes, default="inplace")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of processes to fix pickles with.")
+    parser.add_argument(
+        "--pipeline", action="store_true",
+        help="Search directories, load, fix and write pickles at the same time in one process.")
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Treat the target list as directories of session directories and fix pickles as they land in them, until interrupted.")
+    parser.add_argument(
+        "--poll-seconds", type=float, default=30.0,
+        help="Seconds between searches for new pickles in --watch mode.")
+    parser.add_argument(
+        "--settle-seconds", type=float, default=60.0,
+        help="Seconds a pickle must stay unchanged before its fixed in --watch mode.")
+    parser.add_argument(
+        "--prefetch", type=int, default=2,
+        help="Number of pickles loaded ahead of the one being fixed in --pipeline mode.")
+    parser.add_argument(
+        "--write-behind", type=int, default=2,
+        help="Number of fixed pickles that can wait to be written in --pipeline mode.")
+    parser.add_argument(
+        "--writer", type=str, choices=list(output_writers), default="protocol0",
+        help="Pickle protocol and compression of the fixed pickles.")
+    parser.add_argument(
+        "--output-mode", type=str, choices=output_modes, default="pickle",
+        help="Write whole fixed pickles, patches of the fixes to apply to the original pickles, or pickles split into a skeleton and .npy sidecars of their arrays.")
+    parser.add_argument(
+        "--atomic", action="store_true",
+        help="Write fixed pickles to a temporary file and rename them into place.")
+    parser.add_argument(
+        "--verify-roundtrip", action="store_true",
+        help="Check each fixed pickle reloads equal to the fixed session before keeping it.")
+    parser.add_argument(
+        "--verify-checks", action="store_true",
+        help="Run the checks of tests/test_raw.py on each fixed session and only write the ones that pass.")
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Fix every pickle, even ones the manifest records as unchanged.")
+    parser.add_argument(
+        "--transaction-log", type=str, default=None,
+        help="Path of the json lines log of every fix made, defaults to transactions.jsonl in the output dir.")
+    parser.add_argument(
+        "--catalog", type=str, default=None,
+        help="Path of a sqlite catalog to record the fixed sessions and their fix counts in.")
+    parser.add_argument(
+        "--metrics-path", type=str, default=None,
+        help="Write the time, memory and fix counts of each pickle to this path as json lines.")
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Record the peak memory of each stage in the metrics, slows fixing down.")
 
     args = parser.parse_args()
+    if args.pipeline and args.workers > 1:
+        parser.error("--pipeline runs in a single process, it cant be used with --workers")
+    if args.pipeline and args.trace_memory:
+        parser.error("--trace-memory cant be used with --pipeline")
+    if args.watch and args.pipeline:
+        parser.error("--watch and --pipeline cant be used together")
+    if args.watch and args.force:
+        parser.error("--force cant be used with --watch")
 
     with open(args.target_pickle_list, "r") as f:
         output_dirs = yaml.safe_load(f)
 
-    target_pickles = []
-    for output_dir in output_dirs:
-        pattern = glob.glob(output_dir + "/*.behavior.pkl")
-        pickles = list(glob.glob(output_dir + "/*.behavior.pkl"))
-        if len(pickles) > 1:
-            logger.error(
-                "More than one pickle detected in output dir: %s" % output_dir)
-        elif not len(pickles) > 0:
-            logger.error("No pickles in directory: %s" % output_dir)
-            continue
-
-        target_pickles.append(pickles[0])
-
     if not os.path.isdir(args.output_dir):
         if os.path.exists(args.output_dir):
             raise Exception(
@@ -549,12 +1595,95 @@ if __name__ == "__main__":
         os.makedirs(args.output_dir)
         print("Created output dir at: %s" % args.output_dir)
 
-    for target_pickle in target_pickles:
-        try:
-            fixed_pickle_path = fix_behavior_pickle(
-                target_pickle, args.output_dir)
-            logger.info("Fixed pickle saved to: %s" % fixed_pickle_path)
-        except Exception as e:
-            print("Error fixing pickle: %s" % target_pickle)
-            logger.error("Failed to fix pickle. target=%s." %
-                         (target_pickle, ), exc_info=True)
+    transaction_log = open_transaction_log(
+        args.transaction_log or
+        os.path.join(args.output_dir, "transactions.jsonl"))
+
+    manifest = load_manifest(args.output_dir)
+    # the catalog records the fix counts in the metrics
+    collect_metrics = args.metrics_path is not None or \
+        args.catalog is not None
+
+    def on_watch_result(result: FixResult) -> None:
+        if result.skipped:
+            return
+        if result.error is not None:
+            print("Error fixing pickle: %s" % result.target_pickle)
+        else:
+            print("Fixed pickle: %s" % result.target_pickle)
+        # recorded as they finish, a watch runs until its killed
+        if args.catalog is not None:
+            catalog_fix_results(
+                args.catalog, [result, ], args.writer, args.output_mode)
+
+    try:
+        if args.watch:
+            results = watch_behavior_pickles(
+                output_dirs,
+                args.output_dir,
+                workers=args.workers,
+                manifest=manifest,
+                log_queue=transaction_log.queue,
+                poll_seconds=args.poll_seconds,
+                settle_seconds=args.settle_seconds,
+                on_result=on_watch_result,
+                copy_mode=args.copy_mode,
+                writer=args.writer,
+                output_mode=args.output_mode,
+                atomic=args.atomic,
+                verify_roundtrip=args.verify_roundtrip,
+                verify_checks=args.verify_checks,
+                collect_metrics=collect_metrics,
+                trace_memory=args.trace_memory,
+            )
+        elif args.pipeline:
+            results = fix_behavior_pickles_pipelined(
+                output_dirs,
+                args.output_dir,
+                manifest=manifest,
+                force=args.force,
+                prefetch=args.prefetch,
+                write_behind=args.write_behind,
+                copy_mode=args.copy_mode,
+                writer=args.writer,
+                output_mode=args.output_mode,
+                atomic=args.atomic,
+                verify_roundtrip=args.verify_roundtrip,
+                verify_checks=args.verify_checks,
+                collect_metrics=collect_metrics,
+            )
+        else:
+            target_pickles = find_target_pickles(output_dirs)
+            if args.force:
+                manifest = {
+                    target_pickle: entry
+                    for target_pickle, entry in manifest.items()
+                    if target_pickle not in target_pickles
+                }
+            results = fix_behavior_pickles(
+                target_pickles,
+                args.output_dir,
+                workers=args.workers,
+                manifest=manifest,
+                log_queue=transaction_log.queue,
+                copy_mode=args.copy_mode,
+                writer=args.writer,
+                output_mode=args.output_mode,
+                atomic=args.atomic,
+                verify_roundtrip=args.verify_roundtrip,
+                verify_checks=args.verify_checks,
+                collect_metrics=collect_metrics,
+                trace_memory=args.trace_memory,
+            )
+    finally:
+        close_transaction_log(transaction_log)
+    print_summary(results)
+    if args.catalog is not None and not args.watch:
+        catalog_fix_results(
+            args.catalog, results, args.writer, args.output_mode)
+    if args.metrics_path is not None:
+        write_metrics(results, args.metrics_path)
+        print_metrics(aggregate_metrics(results))
+
+    if any(result.error is not None for result in results):
+        sys.exit(1)
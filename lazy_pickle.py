@@ -0,0 +1,81 @@
+import os
+import bz2
+import gzip
+import lzma
+import pickle
+from typing import IO, Optional
+
+
+# numpy pickles arrays as a call to _reconstruct followed by __setstate__
+reconstruct_modules = ("numpy.core.multiarray", "numpy._core.multiarray", )
+
+
+class LazyArray:
+    """Placeholder for a numpy array in a session loaded with `LazyUnpickler`
+
+    Notes
+    -----
+    - the array data is dropped as soon as its loaded, only the shape and
+    dtype are kept. This is what saves memory, for readers that only need
+    the trial log
+    - the placeholder cant be pickled, the data it would need is gone
+    """
+    __slots__ = ("shape", "dtype", )
+
+    def __init__(self, subtype, shape, dtype_code):
+        self.shape = shape
+        self.dtype = None
+
+    def __setstate__(self, state) -> None:
+        version, shape, dtype, is_fortran, rawdata = state
+        self.shape = shape
+        self.dtype = dtype
+
+    def __reduce_ex__(self, protocol: int):
+        raise Exception("Array data was discarded when it was loaded.")
+
+    def __repr__(self) -> str:
+        return "LazyArray(shape=%s, dtype=%s)" % (self.shape, self.dtype, )
+
+
+class LazyUnpickler(pickle.Unpickler):
+    """Unpickles numpy arrays as `LazyArray` placeholders, everything else is
+    unpickled as usual
+
+    Notes
+    -----
+    - the memo is cleared after loading, it holds everything unpickled and
+    would otherwise keep the whole session alive as long as the unpickler
+    """
+
+    def find_class(self, module: str, name: str):
+        if module in reconstruct_modules and name == "_reconstruct":
+            return LazyArray
+        return super().find_class(module, name)
+
+    def load(self):
+        try:
+            return super().load()
+        finally:
+            self.memo.clear()
+
+
+decompressors = {
+    ".gz": lambda f: gzip.GzipFile(fileobj=f),
+    ".bz2": bz2.BZ2File,
+    ".xz": lzma.LZMAFile,
+}
+
+
+def open_compressed(file: IO, name: str) -> IO:
+    """Wraps a binary file in a decompressor if `name` ends with the suffix of
+    a compressed pickle
+    """
+    decompressor = decompressors.get(os.path.splitext(name)[1])
+    if decompressor is None:
+        return file
+    return decompressor(file)
+
+
+def load_lazy(file: IO, encoding: Optional[str] = "latin1"):
+    return LazyUnpickler(file, encoding=encoding).load()
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+from typing import IO, Dict, Optional, Tuple
+
+
+# bump whenever a change to the fixes changes their output, pickles fixed by
+# an older version are fixed again
+fix_logic_version = "1"
+
+manifest_filename = "manifest.json"
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class HashingReader:
+    """Wraps a binary file, hashing every byte read from it, so a pickle can be
+    hashed while its unpickled instead of being read a second time
+
+    Notes
+    -----
+    - `hexdigest` reads whatever wasnt read yet first, so the hash is always
+    of the whole file, the same as `hash_file`
+    """
+
+    def __init__(self, file: IO):
+        self.file = file
+        self.sha = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.sha.update(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        n = self.file.readinto(buffer)
+        self.sha.update(memoryview(buffer)[:n])
+        return n
+
+    def readline(self, size: int = -1) -> bytes:
+        data = self.file.readline(size)
+        self.sha.update(data)
+        return data
+
+    def hexdigest(self, chunk_size: int = 1 << 20) -> str:
+        for chunk in iter(lambda: self.file.read(chunk_size), b""):
+            self.sha.update(chunk)
+        return self.sha.hexdigest()
+
+
+def load_manifest(output_dir: str) -> Dict[str, Dict]:
+    """Loads the manifest of pickles fixed into `output_dir`, keyed by target
+    pickle path
+    """
+    manifest_path = os.path.join(output_dir, manifest_filename)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir: str, manifest: Dict[str, Dict]) -> None:
+    """Notes
+    -----
+    - written to a temporary file and renamed so an interrupted batch never
+    leaves a truncated manifest
+    """
+    manifest_path = os.path.join(output_dir, manifest_filename)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_fix_current(
+    target_pickle: str,
+    entry: Optional[Dict],
+    writer: str = "protocol0",
+    output_mode: str = "pickle",
+    verify_checks: bool = False,
+) -> Tuple[bool, Dict]:
+    """Whether or not the output recorded in a manifest entry is the fix of
+    the target pickle as it is now
+
+    Notes
+    -----
+    - only hashes files when their size or modification time changed since
+    they were recorded
+    - with `verify_checks` an output that wasnt verified when it was written
+    isnt current, so its fixed and verified again
+    - returns the entry updated with the current file stats and hashes
+    """
+    input_stat = os.stat(target_pickle)
+    if entry is None or entry["fix_version"] != fix_logic_version or \
+            entry["writer"] != writer or \
+            entry.get("output_mode", "pickle") != output_mode or \
+            (verify_checks and not entry.get("verified", False)) or \
+            not os.path.exists(entry["output_path"]):
+        return False, {}
+
+    output_stat = os.stat(entry["output_path"])
+    current = dict(entry)
+    if (input_stat.st_size, input_stat.st_mtime_ns, ) != \
+            (entry["input_size"], entry["input_mtime_ns"], ):
+        current["input_hash"] = hash_file(target_pickle)
+        current["input_size"] = input_stat.st_size
+        current["input_mtime_ns"] = input_stat.st_mtime_ns
+    if (output_stat.st_size, output_stat.st_mtime_ns, ) != \
+            (entry["output_size"], entry["output_mtime_ns"], ):
+        current["output_hash"] = hash_file(entry["output_path"])
+        current["output_size"] = output_stat.st_size
+        current["output_mtime_ns"] = output_stat.st_mtime_ns
+
+    is_current = current["input_hash"] == entry["input_hash"] and \
+        current["output_hash"] == entry["output_hash"]
+    return is_current, current
+
+
+def make_manifest_entry(
+    target_pickle: str,
+    output_path: str,
+    writer: str = "protocol0",
+    output_mode: str = "pickle",
+    input_hash: Optional[str] = None,
+    verified: bool = False,
+) -> Dict:
+    """Notes
+    -----
+    - pass the `input_hash` of the target pickle if its known, eg: from
+    `HashingReader` while loading it, so the pickle isnt read again
+    - `verified` records whether the output passed the checks of
+    `--verify-checks` before it was written
+    """
+    if input_hash is None:
+        input_hash = hash_file(target_pickle)
+    input_stat = os.stat(target_pickle)
+    output_stat = os.stat(output_path)
+    return {
+        "fix_version": fix_logic_version,
+        "writer": writer,
+        "output_mode": output_mode,
+        "verified": verified,
+        "input_hash": input_hash,
+        "input_size": input_stat.st_size,
+        "input_mtime_ns": input_stat.st_mtime_ns,
+        "output_path": output_path,
+        "output_hash": hash_file(output_path),
+        "output_size": output_stat.st_size,
+        "output_mtime_ns": output_stat.st_mtime_ns,
+    }
+
+
@@ -0,0 +1,50 @@
+import sys
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+
+# the sessions keep their native layout, these name the positions of the
+# fields of each record so code reads them without building a wrapper per
+# record
+
+# an entry of a trial's event log, a list of [name, description, time, frame]
+Event = list
+EVENT_NAME, EVENT_DESCRIPTION, EVENT_TIME, EVENT_FRAME = range(4)
+
+# a lick, a tuple of (time, frame)
+Lick = Tuple[float, int]
+LICK_TIME = 0
+
+# (image name, image params), the params are a dict of "Image" and "contrast"
+# in unfixed pickles and the image name again in fixed ones
+Image = Tuple[str, Any]
+IMAGE_NAME, IMAGE_PARAMS = range(2)
+
+# a stimulus change of a trial, a tuple of (from image, to image, time, frame)
+CHANGE_FROM_IMAGE, CHANGE_TO_IMAGE, CHANGE_TIME, CHANGE_FRAME = range(4)
+
+
+@lru_cache(maxsize=None)
+def encode_image_name(image_name: str, contrast: int) -> str:
+    """Serializes image params as a string image name
+
+    Notes
+    -----
+    - Downstream code expects a string image name
+    - names are interned and cached, every trial showing an image shares one
+    string
+    """
+    return sys.intern(f"{image_name}-{contrast}")
+
+
+def encode_image_params(image_params: Dict) -> str:
+    return encode_image_name(image_params["Image"], image_params["contrast"])
+
+
+def fixed_image_name(image: Image) -> str:
+    """Name of an image of a stimulus change once its fixed by `fix_images`,
+    unfixed images have a dict of params
+    """
+    if isinstance(image[IMAGE_PARAMS], dict):
+        return encode_image_params(image[IMAGE_PARAMS])
+    return image[IMAGE_NAME]
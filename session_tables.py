@@ -0,0 +1,392 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from records import CHANGE_FROM_IMAGE, CHANGE_TIME, CHANGE_TO_IMAGE, \
+    EVENT_FRAME, EVENT_NAME, EVENT_TIME, IMAGE_NAME
+
+
+# catch and success are coded as 1 for True, 0 for False and -1 for anything
+# else, eg: "success": None
+trial_dtype = np.dtype([
+    ("index", np.int64),
+    ("catch", np.int8),
+    ("success", np.int8),
+    ("licks_enabled", np.bool_),
+    ("n_changes", np.int32),
+    # codes into image_names of the first stimulus change, -1 if no change
+    ("from_image", np.int32),
+    ("to_image", np.int32),
+    # time of the first stimulus change, nan if no change
+    ("change_time", np.float64),
+])
+
+event_dtype = np.dtype([
+    # row of the trial in the trials table
+    ("trial", np.int32),
+    # code into event_names
+    ("code", np.int32),
+    ("time", np.float64),
+    ("frame", np.int64),
+])
+
+lick_dtype = np.dtype([
+    # row of the trial in the trials table
+    ("trial", np.int32),
+    ("time", np.float64),
+    ("frame", np.int64),
+])
+
+# lick labels
+# before the response window and before the stimulus change, all licks of a
+# trial without a response window are early
+LICK_EARLY = 0
+# strictly inside the response window
+LICK_WITHIN = 1
+# at or after the end of the response window
+LICK_LATE = 2
+# after the stimulus change but not after the start of the response window
+LICK_OTHER = 3
+
+
+class ResponseWindows(NamedTuple):
+    """Per trial response window bounds, rows match the trials table
+    """
+    # whether or not the trial has both response window events
+    has_window: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    # time of the first stimulus_changed event, nan if there isnt one
+    change_time: np.ndarray
+    aborted: np.ndarray
+
+
+def code_flag(value) -> int:
+    if value is True:
+        return 1
+    if value is False:
+        return 0
+    return -1
+
+
+def code_name(names: Dict[str, int], name: str) -> int:
+    try:
+        return names[name]
+    except KeyError:
+        names[name] = len(names)
+        return names[name]
+
+
+def stimulus_change_image_name(image: Tuple[str, Any]) -> str:
+    return image[0]
+
+
+class ImageTransitions(NamedTuple):
+    """The images of each trial of a session, rows are in trial log order
+
+    Notes
+    -----
+    - `prev_image` is the image shown when a trial started, the image
+    changed to by the last trial before it with a stimulus change or the
+    initial image if there isnt one
+    - images are codes into `image_names`, `from_image` and `to_image` are -1
+    for trials without a stimulus change and `prev_image` is -1 until the
+    first change if the initial image isnt supplied
+    """
+    index: np.ndarray
+    prev_image: np.ndarray
+    from_image: np.ndarray
+    to_image: np.ndarray
+    change_time: np.ndarray
+    image_names: List[str]
+
+    @classmethod
+    def from_codes(
+        cls,
+        index: np.ndarray,
+        from_image: np.ndarray,
+        to_image: np.ndarray,
+        change_time: np.ndarray,
+        initial_image: int,
+        image_names: List[str],
+    ) -> "ImageTransitions":
+        rows = np.where(to_image >= 0, np.arange(len(to_image)), -1)
+        # row of the last change before each trial, not counting its own
+        prev_change = np.concatenate((
+            [-1, ],
+            np.maximum.accumulate(rows),
+        ))[:len(rows)].astype(np.int64)
+        prev_image = np.where(
+            prev_change >= 0,
+            to_image[prev_change],
+            initial_image,
+        ).astype(np.int32)
+        return cls(
+            index, prev_image, from_image, to_image, change_time, image_names)
+
+    @classmethod
+    def from_trials(
+        cls,
+        trial_log: List[dict],
+        initial_image: Optional[str] = None,
+        image_name: Callable[[Tuple[str, Any]], str] = stimulus_change_image_name,
+    ) -> "ImageTransitions":
+        """Notes
+        -----
+        - `image_name` names the (name, params) images of a stimulus change,
+        by default with the name they have in the trial log
+        """
+        image_names: Dict[str, int] = {}
+        if initial_image is None:
+            initial_image_code = -1
+        else:
+            initial_image_code = code_name(image_names, initial_image)
+
+        index = np.empty(len(trial_log), dtype=np.int64)
+        from_image = np.full(len(trial_log), -1, dtype=np.int32)
+        to_image = np.full(len(trial_log), -1, dtype=np.int32)
+        change_time = np.full(len(trial_log), np.nan)
+        for row, trial in enumerate(trial_log):
+            index[row] = trial["index"]
+            stimulus_changes = trial["stimulus_changes"]
+            if len(stimulus_changes) > 0:
+                from_image[row] = code_name(
+                    image_names,
+                    image_name(stimulus_changes[0][CHANGE_FROM_IMAGE]),
+                )
+                to_image[row] = code_name(
+                    image_names,
+                    image_name(stimulus_changes[0][CHANGE_TO_IMAGE]),
+                )
+                change_time[row] = stimulus_changes[0][CHANGE_TIME]
+
+        return cls.from_codes(
+            index,
+            from_image,
+            to_image,
+            change_time,
+            initial_image_code,
+            list(image_names),
+        )
+
+    def has_change(self) -> np.ndarray:
+        return self.to_image >= 0
+
+    def initial_image_mismatches(self) -> np.ndarray:
+        """Mask of the trials whose change doesnt start from the image shown
+        when the trial started
+        """
+        return self.has_change() & (self.from_image != self.prev_image)
+
+
+class SessionTables(NamedTuple):
+    """Columnar view of the trial log of a behavior session
+
+    Notes
+    -----
+    - built in a single pass over the trial log and its events
+    - `trials` has one row per trial log entry, in trial log order
+    - `events` has one row per event, grouped by trial and in trial order
+    - `licks` has one row per entry of the "licks" of each trial, grouped by
+    trial and in trial order
+    """
+    trials: np.ndarray
+    events: np.ndarray
+    licks: np.ndarray
+    event_names: List[str]
+    image_names: List[str]
+    # code into image_names, -1 if not supplied
+    initial_image: int
+
+    @classmethod
+    def from_session(cls, data: dict, initial_image: str) -> "SessionTables":
+        return cls.from_trials(
+            data["items"]["behavior"]["trial_log"], initial_image)
+
+    @classmethod
+    def from_trials(
+        cls,
+        trial_log: List[dict],
+        initial_image: Optional[str] = None,
+    ) -> "SessionTables":
+        event_names: Dict[str, int] = {}
+        image_names: Dict[str, int] = {}
+        if initial_image is None:
+            initial_image_code = -1
+        else:
+            initial_image_code = code_name(image_names, initial_image)
+
+        trials = np.empty(len(trial_log), dtype=trial_dtype)
+        rows = []
+        event_trials = []
+        event_codes = []
+        event_times = []
+        event_frames = []
+        licks = []
+        for row, trial in enumerate(trial_log):
+            stimulus_changes = trial["stimulus_changes"]
+            if len(stimulus_changes) > 0:
+                from_image = code_name(
+                    image_names, stimulus_changes[0][CHANGE_FROM_IMAGE][IMAGE_NAME])
+                to_image = code_name(
+                    image_names, stimulus_changes[0][CHANGE_TO_IMAGE][IMAGE_NAME])
+                change_time = stimulus_changes[0][CHANGE_TIME]
+            else:
+                from_image = to_image = -1
+                change_time = np.nan
+            rows.append((
+                trial["index"],
+                code_flag(trial["trial_params"]["catch"]),
+                code_flag(trial["success"]),
+                bool(trial["licks_enabled"]),
+                len(stimulus_changes),
+                from_image,
+                to_image,
+                change_time,
+            ))
+            for event in trial["events"]:
+                event_trials.append(row)
+                event_codes.append(code_name(event_names, event[EVENT_NAME]))
+                event_times.append(event[EVENT_TIME])
+                event_frames.append(event[EVENT_FRAME])
+            for lick_time, lick_frame in trial["licks"]:
+                licks.append((row, lick_time, lick_frame, ))
+
+        trials[:] = rows
+        events = np.empty(len(event_trials), dtype=event_dtype)
+        events["trial"] = event_trials
+        events["code"] = event_codes
+        events["time"] = event_times
+        events["frame"] = event_frames
+
+        return cls(
+            trials,
+            events,
+            np.array(licks, dtype=lick_dtype),
+            list(event_names),
+            list(image_names),
+            initial_image_code,
+        )
+
+    def image_transitions(self) -> ImageTransitions:
+        return ImageTransitions.from_codes(
+            self.trials["index"],
+            self.trials["from_image"],
+            self.trials["to_image"],
+            self.trials["change_time"],
+            self.initial_image,
+            self.image_names,
+        )
+
+    def event_codes(self, prefix: str) -> np.ndarray:
+        """Codes of the event names that start with `prefix`
+        """
+        return np.array([
+            code for code, name in enumerate(self.event_names)
+            if name.startswith(prefix)
+        ], dtype=np.int32)
+
+    def events_matching(self, prefix: str) -> np.ndarray:
+        """Mask of the events whose name starts with `prefix`
+        """
+        return np.isin(self.events["code"], self.event_codes(prefix))
+
+    def trials_with(self, prefix: str) -> np.ndarray:
+        """Mask of the trials that have an event whose name starts with
+        `prefix`
+        """
+        has_event = np.zeros(len(self.trials), dtype=np.bool_)
+        has_event[self.events["trial"][self.events_matching(prefix)]] = True
+        return has_event
+
+    def count_events(self, prefix: str) -> np.ndarray:
+        """Number of events whose name starts with `prefix` in each trial
+        """
+        return np.bincount(
+            self.events["trial"][self.events_matching(prefix)],
+            minlength=len(self.trials),
+        )
+
+    def disabled_licks(self) -> np.ndarray:
+        """Licks recorded as "licks disabled." events, licks arent populated
+        while licks are disabled
+        """
+        events = self.events[self.events_matching("licks disabled.")]
+        licks = np.empty(len(events), dtype=lick_dtype)
+        licks["trial"] = events["trial"]
+        licks["time"] = events["time"]
+        licks["frame"] = events["frame"]
+        return licks
+
+    def first_event_times(self, prefix: str, nth: int = 0) -> np.ndarray:
+        """Time of the `nth` event whose name starts with `prefix` in each
+        trial, nan for trials with fewer events
+        """
+        events = self.events[self.events_matching(prefix)]
+        n_trials = len(self.trials)
+        # events are grouped by trial so the first event of each trial is
+        # where its row would be inserted
+        first = np.searchsorted(events["trial"], np.arange(n_trials))
+        counts = np.bincount(events["trial"], minlength=n_trials)
+        has_event = counts > nth
+        times = np.full(n_trials, np.nan)
+        times[has_event] = events["time"][first[has_event] + nth]
+        return times
+
+    def response_windows(self) -> ResponseWindows:
+        return ResponseWindows(
+            self.count_events("response_window") >= 2,
+            self.first_event_times("response_window", 0),
+            self.first_event_times("response_window", 1),
+            self.first_event_times("stimulus_changed"),
+            self.trials_with("abort"),
+        )
+
+    def lick_labels(
+        self,
+        licks: np.ndarray,
+        windows: Optional[ResponseWindows] = None,
+    ) -> np.ndarray:
+        """Labels every lick as one of LICK_EARLY, LICK_WITHIN, LICK_LATE or
+        LICK_OTHER
+
+        Notes
+        -----
+        - same rules as `classify_licks`, labels licks of all trials at once
+        - licks of trials without a response window are labeled early whether
+        or not the trial was aborted, check `windows` for trials that have
+        neither
+        """
+        if windows is None:
+            windows = self.response_windows()
+
+        trial = licks["trial"]
+        time = licks["time"]
+        lower = windows.lower[trial]
+        upper = windows.upper[trial]
+        change_time = windows.change_time[trial]
+        has_window = windows.has_window[trial]
+
+        labels = np.full(len(licks), LICK_OTHER, dtype=np.int8)
+        labels[time >= upper] = LICK_LATE
+        labels[(lower < time) & (time < upper)] = LICK_WITHIN
+        # licks dont count as aborts if theyre before the response window but
+        # after the stimulus change
+        labels[
+            (time < lower) & (np.isnan(change_time) | (time < change_time))
+        ] = LICK_EARLY
+        labels[~has_window] = LICK_EARLY
+        return labels
+
+    def count_licks(
+        self,
+        licks: np.ndarray,
+        labels: np.ndarray,
+        label: int,
+    ) -> np.ndarray:
+        """Number of licks with `label` in each trial
+        """
+        return np.bincount(
+            licks["trial"][labels == label],
+            minlength=len(self.trials),
+        )
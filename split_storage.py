@@ -0,0 +1,135 @@
+import os
+import copyreg
+import pickle
+from functools import partial
+from typing import IO, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+# arrays smaller than this stay in the skeleton, a sidecar per small array
+# would cost more to open than it saves
+default_min_bytes = 1 << 16
+
+
+class ArraySidecar(NamedTuple):
+    """Placeholder for an array of a split session, stored in its sidecar
+    .npy file in the arrays directory of the session
+    """
+    filename: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def arrays_dir(skeleton_path: str) -> str:
+    """Directory the sidecars of the skeleton at `skeleton_path` are written
+    to, the skeleton name without its suffixes plus ".arrays"
+    """
+    name = os.path.basename(skeleton_path).rsplit(".split", 1)[0]
+    return os.path.join(os.path.dirname(skeleton_path), name + ".arrays")
+
+
+def sidecar_filename(n: int) -> str:
+    return "%s.npy" % n
+
+
+def remove_stale_sidecars(directory: str, n_sidecars: int) -> None:
+    """Removes the sidecars in `directory` numbered `n_sidecars` or more,
+    left over from an earlier split of the session that had more arrays
+    """
+    for filename in os.listdir(directory):
+        stem, extension = os.path.splitext(filename)
+        if extension == ".npy" and stem.isdigit() and int(stem) >= n_sidecars:
+            os.remove(os.path.join(directory, filename))
+
+
+def write_sidecar(array: np.ndarray, path: str) -> None:
+    with open(path, "wb") as f:
+        np.save(f, array, allow_pickle=False)
+
+
+def is_splittable(array, min_bytes: int) -> bool:
+    """Notes
+    -----
+    - object arrays arent split, they cant be memory mapped
+    """
+    dtype = np.dtype(array.dtype)
+    return not dtype.hasobject and \
+        int(np.prod(array.shape)) * dtype.itemsize >= min_bytes
+
+
+class SplitPickler(pickle.Pickler):
+    """Pickles arrays of at least `min_bytes` as `ArraySidecar` placeholders
+    and writes them to .npy sidecars in `directory`, everything else is
+    pickled as usual
+
+    Notes
+    -----
+    - arrays are swapped for placeholders through the dispatch table, which
+    the pickler only consults for types it has no fast path for, so the
+    millions of numbers in a session are pickled at full speed
+    - sidecars are numbered in the order they're pickled, 0.npy, 1.npy, ...
+    """
+
+    def __init__(
+        self,
+        file: IO,
+        directory: str,
+        protocol: int = pickle.HIGHEST_PROTOCOL,
+        min_bytes: int = default_min_bytes,
+    ):
+        super().__init__(file, protocol=protocol)
+        self.directory = directory
+        self.protocol = protocol
+        self.min_bytes = min_bytes
+        self.n_sidecars = 0
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        self.dispatch_table[np.ndarray] = self.reduce_array
+
+    def reduce_array(self, array):
+        if not is_splittable(array, self.min_bytes):
+            return array.__reduce_ex__(self.protocol)
+        filename = sidecar_filename(self.n_sidecars)
+        self.n_sidecars += 1
+        write_sidecar(array, os.path.join(self.directory, filename))
+        return ArraySidecar, (filename, array.shape, array.dtype.str, )
+
+
+class SplitUnpickler(pickle.Unpickler):
+    """Unpickles a skeleton pickled by `SplitPickler` with its arrays loaded
+    from their sidecars in `directory`
+
+    Notes
+    -----
+    - with a `mmap_mode` the arrays are memory mapped, only the pages that
+    are read are ever loaded
+    - the class returned for placeholders doesnt reference the unpickler and
+    the memo is cleared after loading, a reference cycle through the memo
+    would keep the whole session alive until the garbage collector runs
+    """
+
+    def __init__(self, file: IO, directory: str, mmap_mode: Optional[str] = "r"):
+        super().__init__(file)
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+    def find_class(self, module: str, name: str):
+        if module == ArraySidecar.__module__ and name == ArraySidecar.__name__:
+            return partial(load_sidecar, self.directory, self.mmap_mode)
+        return super().find_class(module, name)
+
+    def load(self):
+        try:
+            return super().load()
+        finally:
+            self.memo.clear()
+
+
+def load_sidecar(
+    directory: str,
+    mmap_mode: Optional[str],
+    filename: str,
+    shape: Tuple[int, ...],
+    dtype: str,
+) -> np.ndarray:
+    return np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
@@ -0,0 +1,231 @@
+import random
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class Faults(NamedTuple):
+    """Probability of each of the faults fixed by `fix_nondoc_pickle` in the
+    trials it can occur in
+
+    Notes
+    -----
+    - success_none: go trials with `"success": None`
+    - faux_go: go trials that change to the image already shown
+    - faux_catch: catch trials that change to a new image
+    - bad_initial_image: changes whose initial image isnt the image already
+    shown, like when a scheduled change never occurred
+    - lick_disabled_miss: licks disabled trials with a lick in the response
+    window labeled a miss or rejection
+    """
+    success_none: float = 0.0
+    faux_go: float = 0.0
+    faux_catch: float = 0.0
+    bad_initial_image: float = 0.0
+    lick_disabled_miss: float = 0.0
+
+
+default_faults = Faults(
+    success_none=0.02,
+    faux_go=0.05,
+    faux_catch=0.05,
+    bad_initial_image=0.02,
+    lick_disabled_miss=0.05,
+)
+
+# roughly what camstim logs at 60Hz
+frame_rate = 60
+trial_frames = 270
+change_frame = 135
+response_window = (9, 45, )  # frames after the change
+
+image_names = ["im%03d" % i for i in range(8)]
+contrast = 1
+
+
+def image_params(image_name: str) -> Tuple[str, Dict]:
+    return image_name, {"Image": image_name, "contrast": contrast, }
+
+
+def make_event(name: str, description: str, frame: int) -> List:
+    return [name, description, frame / frame_rate, frame, ]
+
+
+def make_lick(frame: int) -> Tuple[float, int]:
+    return frame / frame_rate, frame
+
+
+def make_trial(
+    index: int,
+    start_frame: int,
+    rng: random.Random,
+    prev_image: str,
+    faults: Faults,
+) -> Tuple[Dict, Optional[str]]:
+    """Generates a trial of the change detection task
+
+    Returns
+    -------
+    the trial and the image it changed to, None if it didnt change
+    """
+    catch = rng.random() < 0.25
+    licks_enabled = rng.random() > 0.1
+    aborted = rng.random() < 0.2
+    lick_disabled_miss = not licks_enabled and \
+        rng.random() < faults.lick_disabled_miss
+
+    events = [
+        make_event("initial_blank", "enter", start_frame),
+        make_event("initial_blank", "exit", start_frame + 1),
+        make_event("pre_change", "enter", start_frame + 1),
+    ]
+    licks = []
+    rewards = []
+    stimulus_changes = []
+    to_image = None
+
+    if aborted and not lick_disabled_miss:
+        lick_frame = start_frame + rng.randrange(30, change_frame)
+        licks.append(make_lick(lick_frame))
+        if not licks_enabled:
+            events.append(make_event("licks disabled.lick", "", lick_frame))
+        events.append(make_event("abort", "", lick_frame))
+    else:
+        frame = start_frame + change_frame
+        if catch:
+            to_image = prev_image
+            if rng.random() < faults.faux_catch:
+                to_image = rng.choice(
+                    [name for name in image_names if name != prev_image])
+        else:
+            to_image = rng.choice(
+                [name for name in image_names if name != prev_image])
+            if rng.random() < faults.faux_go:
+                to_image = prev_image
+
+        from_image = prev_image
+        if rng.random() < faults.bad_initial_image:
+            from_image = rng.choice(image_names)
+
+        stimulus_changes.append((
+            image_params(from_image),
+            image_params(to_image),
+            frame / frame_rate,
+            frame,
+        ))
+        events.append(make_event("stimulus_changed", "", frame))
+        events.append(make_event(
+            "sham_change" if catch else "change", "", frame))
+        events.append(make_event(
+            "response_window", "enter", frame + response_window[0]))
+
+        if licks_enabled:
+            licked = rng.random() < (0.3 if catch else 0.7)
+        else:
+            licked = lick_disabled_miss
+        if licked:
+            lick_frame = frame + rng.randrange(
+                response_window[0] + 1, response_window[1])
+            licks.append(make_lick(lick_frame))
+            if not licks_enabled:
+                events.append(
+                    make_event("licks disabled.lick", "", lick_frame))
+            elif catch:
+                events.append(make_event("false_alarm", "", lick_frame))
+            else:
+                events.append(make_event("hit", "", lick_frame))
+                rewards.append((lick_frame / frame_rate, lick_frame, ))
+
+        events.append(make_event(
+            "response_window", "exit", frame + response_window[1]))
+        if not licked or not licks_enabled:
+            events.append(make_event(
+                "rejection" if catch else "miss", "",
+                frame + response_window[1]))
+
+    success = not aborted
+    if not catch and not aborted and rng.random() < faults.success_none:
+        success = None
+
+    return {
+        "index": index,
+        "success": success,
+        "licks_enabled": licks_enabled,
+        "trial_params": {"catch": catch, },
+        "stimulus_changes": stimulus_changes,
+        "events": events,
+        "licks": licks,
+        "rewards": rewards,
+    }, to_image
+
+
+def make_session(
+    n_trials: int,
+    faults: Faults = default_faults,
+    seed: int = 0,
+) -> Dict:
+    """Generates a camstim behavior session shaped like the ones the fixer
+    and tests read
+
+    Notes
+    -----
+    - the stimuli are logged as "images-params" like the sessions generated
+    by the buggy task
+    - per frame arrays (encoders, intervalsms) are sized like a real session
+    of the same length so loading and writing it costs about the same
+    """
+    rng = random.Random(seed)
+    initial_image = image_names[0]
+    set_log = [
+        ("Image", initial_image, 0.0, 0, ),
+        ("contrast", contrast, 0.0, 0, ),
+    ]
+
+    trial_log = []
+    prev_image = initial_image
+    for index in range(n_trials):
+        start_frame = index * trial_frames
+        trial, to_image = make_trial(
+            index, start_frame, rng, prev_image, faults)
+        trial_log.append(trial)
+        # the changes of trials that ran too long never occurred
+        if trial["success"] is None:
+            continue
+        if to_image is not None and to_image != prev_image:
+            frame = start_frame + change_frame
+            set_log.append(("Image", to_image, frame / frame_rate, frame, ))
+            set_log.append(("contrast", contrast, frame / frame_rate, frame, ))
+        if to_image is not None:
+            prev_image = to_image
+
+    n_frames = n_trials * trial_frames
+    random_state = np.random.RandomState(seed)
+    return {
+        "items": {
+            "behavior": {
+                "params": {
+                    "initial_image_params": {
+                        "Image": initial_image,
+                        "contrast": contrast,
+                    },
+                },
+                "stimuli": {
+                    "images-params": {
+                        "obj_type": "ImageStimulus",
+                        "set_log": set_log,
+                        "draw_log": [1, ] * n_frames,
+                    },
+                },
+                "trial_log": trial_log,
+                "encoders": [
+                    {
+                        "dx": random_state.rand(n_frames),
+                        "vsig": random_state.rand(n_frames),
+                        "vin": random_state.rand(n_frames),
+                    },
+                ],
+                "intervalsms": random_state.normal(
+                    1000 / frame_rate, 0.1, max(n_frames - 1, 0)),
+            },
+        },
+    }
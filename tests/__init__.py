@@ -2,9 +2,17 @@ from __future__ import annotations
 
 import os
 import typing
-import pandas as pd
-from visual_behavior.translator.core import create_extended_dataframe
-from visual_behavior.translator import foraging2
+
+from event_index import EventIndex
+from lazy_pickle import load_lazy, open_compressed
+from records import EVENT_FRAME, EVENT_NAME, EVENT_TIME, LICK_TIME, Event, \
+    Lick, encode_image_params
+
+# pandas and visual_behavior are imported by the helpers that need them,
+# importing them takes longer than everything else the tests and workers
+# import put together
+if typing.TYPE_CHECKING:
+    import pandas as pd
 
 
 def load_dotenv(path=".env"):
@@ -27,11 +35,23 @@ def resolve_env_var(name: str, required=True) -> typing.Union[str, None]:
                 "Required environment variable: %s not set." % name)
 
 
-def load_pickle(path: str) -> typing.Dict:
+def load_pickle(path: str, skip_arrays: bool = False) -> typing.Dict:
+    """Notes
+    -----
+    - if `skip_arrays` is True numpy arrays are loaded as `LazyArray`
+    placeholders without their data, the raw checks never read them
+    """
+    if skip_arrays:
+        with open(path, "rb") as f:
+            return load_lazy(open_compressed(f, path))
+    import pandas as pd
     return pd.read_pickle(path)
 
 
 def load_extended_trials_df(raw: typing.Dict) -> pd.DataFrame:
+    from visual_behavior.translator.core import create_extended_dataframe
+    from visual_behavior.translator import foraging2
+
     core_data = foraging2.data_to_change_detection_core(raw)
     return create_extended_dataframe(
         trials=core_data['trials'],
@@ -41,17 +61,9 @@ def load_extended_trials_df(raw: typing.Dict) -> pd.DataFrame:
     )
 
 
-def encode_image_name(image_name: str, contrast: int) -> str:
-    return f"{image_name}-{contrast}"
-
-
 def get_initial_image(data: dict) -> str:
-    initial_params = data["items"]["behavior"]["params"]["initial_image_params"]
-    return encode_image_name(initial_params["Image"], initial_params["contrast"])
-
-
-# __future__ import not giving me tuple?
-Event = typing.Tuple[str, str, float, int]
+    return encode_image_params(
+        data["items"]["behavior"]["params"]["initial_image_params"])
 
 
 def filter_events(trial: dict, name_fiter: str) -> list[Event]:
@@ -59,55 +71,60 @@ def filter_events(trial: dict, name_fiter: str) -> list[Event]:
     """
     return [
         event for event in trial["events"]
-        if event[0].startswith(name_fiter)
+        if event[EVENT_NAME].startswith(name_fiter)
     ]
 
 
-# __future__ import not giving me tuple?
-Lick = typing.Tuple[float, int]
-
-
 def is_early_lick(
     lick: Lick,
     response_window_lower: float,
     stimulus_change_events: list[Event],
 ) -> bool:
-    lick_time, _ = lick
+    lick_time = lick[LICK_TIME]
     if not lick_time < response_window_lower:
         return False
 
     # licks dont count as aborts if theyre before the response window but after
     # the stimulus change
     if len(stimulus_change_events) > 0:
-        return lick_time < stimulus_change_events[0][2]
+        return lick_time < stimulus_change_events[0][EVENT_TIME]
     else:
         return True
 
 
-def classify_licks(trial) -> tuple[list[Lick], list[Lick]]:
+def classify_licks(
+    trial,
+    events: typing.Optional[EventIndex] = None,
+) -> tuple[list[Lick], list[Lick]]:
     """
+    Parameters
+    ----------
+    events: index of the trial's events, built if not supplied
+
     Returns
     -------
     early licks
     licks within window
     """
-    response_window_events = filter_events(trial, "response_window")
+    if events is None:
+        events = EventIndex.from_trial(trial)
+    response_window_events = events.filter("response_window")
     if len(response_window_events) < 2:
-        abort_events = filter_events(trial, "abort")
+        abort_events = events.filter("abort")
         if len(abort_events) < 1:
             raise Exception("No response window but not aborted!")
         return trial["licks"], []
 
-    response_window_lower = response_window_events[0][2]
-    response_window_upper = response_window_events[1][2]
-    stimulus_change_events = filter_events(trial, "stimulus_changed")
+    response_window_lower = response_window_events[0][EVENT_TIME]
+    response_window_upper = response_window_events[1][EVENT_TIME]
+    stimulus_change_events = events.filter("stimulus_changed")
     early = list(filter(
         lambda lick: is_early_lick(
             lick, response_window_lower, stimulus_change_events),
         trial["licks"],
     ))
     within_window = list(filter(
-        lambda lick: response_window_lower < lick[0] < response_window_upper,
+        lambda lick: response_window_lower < lick[LICK_TIME] < response_window_upper,
         trial["licks"],
     ))
 
@@ -137,16 +154,17 @@ def get_invalid_lick_disabled_trials(raw):
         if log["licks_enabled"] is True:
             continue
 
-        disabled_licks = filter_events(log, "licks disabled.")
-        response_window_events = filter_events(log, "response_window")
+        events = EventIndex.from_trial(log)
+        disabled_licks = events.filter("licks disabled.")
+        response_window_events = events.filter("response_window")
         if not len(response_window_events) == 2:
             continue
 
         within_window_licks = list(filter(
             lambda event: lick_within_response_window(
                 event,
-                response_window_events[0][3],
-                response_window_events[1][3],
+                response_window_events[0][EVENT_FRAME],
+                response_window_events[1][EVENT_FRAME],
             ),
             disabled_licks
         ))
@@ -154,7 +172,7 @@ def get_invalid_lick_disabled_trials(raw):
         if not len(within_window_licks) > 0:
             continue
 
-        if len(filter_events(log, "miss")) > 0:
+        if events.has("miss"):
             invalid_indices.append(log["index"])
 
     return invalid_indices
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import time
+import typing
+
+import numpy as np
+
+from session_tables import SessionTables, ResponseWindows, LICK_EARLY, \
+    LICK_WITHIN
+
+from . import get_initial_image, get_invalid_lick_disabled_trials
+
+
+class CheckedSession(typing.NamedTuple):
+    """Everything the checks read from a session, built once and shared by
+    all of them
+    """
+    raw: typing.Dict
+    tables: SessionTables
+    windows: ResponseWindows
+    lick_labels: np.ndarray
+
+    @classmethod
+    def from_raw(cls, raw: typing.Dict) -> "CheckedSession":
+        tables = SessionTables.from_session(raw, get_initial_image(raw))
+        windows = tables.response_windows()
+        return cls(
+            raw,
+            tables,
+            windows,
+            tables.lick_labels(tables.licks, windows),
+        )
+
+
+def check_catch_trials_have_no_changes(session: CheckedSession) -> typing.List[int]:
+    """Checks that trials don't have stimulus changes, and if they do verifies 
+    that they change to the same image identity
+    """
+    tables = session.tables
+    trials = tables.trials
+    # catch trials with stimulus changes to different stim is bad
+    bad_trial_indices = trials["index"][
+        (trials["catch"] == 1) &
+        (trials["n_changes"] > 1) &
+        (trials["from_image"] != trials["to_image"])
+    ].tolist()
+
+    return bad_trial_indices
+
+
+def check_image_sequence(session: CheckedSession) -> typing.List[int]:
+    """Tests that image name is contiguous across trials. If there was a 
+    stimulus change in the previous trial, the initial image of the next change
+    should be the final image of the previous change.
+    """
+    transitions = session.tables.image_transitions()
+    bad_trial_indices = transitions.index[
+        transitions.initial_image_mismatches()
+    ].tolist()
+
+    return bad_trial_indices
+
+
+def check_event_log(session: CheckedSession) -> typing.List[int]:
+    """Tests that trials dont have incorrect events based on whether theyre go
+    or catch
+
+    Notes
+    -----
+    - go trials should not have: sham_change, rejection, false_alarm
+    - catch trials should not have: change, hit, miss
+    """
+    tables = session.tables
+    trials = tables.trials
+    bad_go = tables.trials_with("sham_change") | \
+        tables.trials_with("false_alarm") | \
+        tables.trials_with("rejection")
+    bad_catch = tables.trials_with("change") | \
+        tables.trials_with("hit") | \
+        tables.trials_with("miss")
+    bad_trial_indices = \
+        trials["index"][(trials["catch"] == 0) & bad_go].tolist() + \
+        trials["index"][(trials["catch"] == 1) & bad_catch].tolist()
+
+    return bad_trial_indices
+
+
+def check_abort_licks(session: CheckedSession) -> typing.List[int]:
+    """Tests that trials in which the mouse licked before the change or 
+    sham-change are listed as aborts in the trial log
+    """
+    tables = session.tables
+    windows = session.windows
+    lick_labels = session.lick_labels
+    if np.any(~windows.has_window & ~windows.aborted):
+        raise Exception("No response window but not aborted!")
+
+    early = tables.count_licks(tables.licks, lick_labels, LICK_EARLY)
+    bad_trial_indices = tables.trials["index"][
+        (early > 0) & ~windows.aborted
+    ].tolist()
+
+    return bad_trial_indices
+
+
+def check_non_abort_event_log(session: CheckedSession) -> typing.List[int]:
+    """Tests that:
+    1) non-abort trials for which catch is True have the following response 
+    types:
+        a) no lick in the response window: rejection
+        b) lick in the response window: false alarm 
+    2) non-abort trials for which catch is False:
+        a) no lick in the response window: miss
+        b) lick in the response window: hit
+    """
+    tables = session.tables
+    windows = session.windows
+    lick_labels = session.lick_labels
+    trials = tables.trials
+    within = tables.count_licks(tables.licks, lick_labels, LICK_WITHIN)
+    hit = tables.count_events("hit")
+    miss = tables.count_events("miss")
+    rejection = tables.count_events("rejection")
+    false_alarm = tables.count_events("false_alarm")
+
+    # auto rewarded trials have weird event logic, TODO: pair this with actual hit/miss events?
+    checked = windows.aborted & ~tables.trials_with("auto_reward")
+    if np.any(checked & (trials["catch"] == -1)):
+        raise Exception("Unexpected catch type.")
+
+    go = checked & (trials["catch"] == 0)
+    catch = checked & (trials["catch"] == 1)
+    bad = \
+        go & (within > 0) & (
+            (hit < 1) | (miss > 0) | (rejection > 0) | (false_alarm > 0)
+        ) | \
+        go & (within < 0) & (
+            (miss < 1) | (rejection > 0) | (hit > 0) | (false_alarm > 0)
+        ) | \
+        catch & (within > 0) & (
+            (rejection < 1) | (false_alarm > 0) | (hit > 0) | (miss > 0)
+        ) | \
+        catch & (within < 0) & (
+            (false_alarm < 1) | (hit > 0) | (miss > 0) | (rejection > 0)
+        )
+    bad_trial_indices = trials["index"][bad].tolist()
+
+    return bad_trial_indices
+
+
+def check_non_abort_catch_same_image(session: CheckedSession) -> typing.List[int]:
+    """Tests all non-abort catch trials have same image
+    """
+    tables = session.tables
+    trials = tables.trials
+    bad_trial_indices = trials["index"][
+        (trials["catch"] == 1) &
+        (trials["n_changes"] > 0) &
+        (trials["from_image"] != trials["to_image"])
+    ].tolist()
+
+    return bad_trial_indices
+
+
+def check_non_abort_go_have_change(session: CheckedSession) -> typing.List[int]:
+    """Tests all non-abort go trials have a change
+    """
+    tables = session.tables
+    trials = tables.trials
+    bad_trial_indices = trials["index"][
+        (trials["catch"] == 0) &
+        ~tables.trials_with("abort") &
+        (trials["n_changes"] > 1)
+    ].tolist()
+
+    return bad_trial_indices
+
+
+def check_no_reward_epoch(session: CheckedSession) -> typing.List[int]:
+    return get_invalid_lick_disabled_trials(session.raw)
+
+
+# every check, by name. A check returns the indices of the trials that fail
+# it, it raises if the session cant be checked
+checks: typing.Dict[str, typing.Callable[[CheckedSession], typing.List[int]]] = {
+    "catch_trials_have_no_changes": check_catch_trials_have_no_changes,
+    "image_sequence": check_image_sequence,
+    "event_log": check_event_log,
+    "abort_licks": check_abort_licks,
+    "non_abort_event_log": check_non_abort_event_log,
+    "non_abort_catch_same_image": check_non_abort_catch_same_image,
+    "non_abort_go_have_change": check_non_abort_go_have_change,
+    "no_reward_epoch": check_no_reward_epoch,
+}
+
+
+class CheckResult(typing.NamedTuple):
+    check: str
+    violations: typing.List[int]
+    error: typing.Optional[str]
+    seconds: float
+
+
+def run_checks(
+    session: typing.Any,
+    session_checks: typing.Dict[str, typing.Callable] = checks,
+) -> typing.List[CheckResult]:
+    """Runs every check on a session, a check that raises doesnt stop the
+    others
+
+    Notes
+    -----
+    - `session_checks` and the `session` they take can also be
+    `tests.extended_checks.extended_checks` and a `CheckedExtendedTrials`
+    """
+    results = []
+    for name, check in session_checks.items():
+        start = time.perf_counter()
+        try:
+            violations, error = check(session), None
+        except Exception as e:
+            violations, error = [], repr(e)
+        results.append(CheckResult(
+            name, violations, error, time.perf_counter() - start))
+    return results
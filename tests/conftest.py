@@ -1,13 +1,48 @@
 import pytest
 import glob
 
-from . import resolve_env_var, load_pickle
+from . import resolve_env_var, load_pickle, load_extended_trials_df
+from .checks import CheckedSession
+from .extended_checks import CheckedExtendedTrials
+from .session_cache import load_cached_session, \
+    load_cached_extended_trials_df, default_max_bytes
 
 
 pickle_search_pattern = resolve_env_var("PICKLE_SEARCH_PATTERN")
 pickles = glob.glob(pickle_search_pattern)
 
+pickle_cache_dir = resolve_env_var("PICKLE_CACHE_DIR", required=False)
+pickle_cache_max_bytes = int(resolve_env_var(
+    "PICKLE_CACHE_MAX_BYTES", required=False) or default_max_bytes)
+
 
 @pytest.fixture(scope="session", params=pickles)
-def raw(request):
-    return load_pickle(request.param)
+def pickle_path(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def raw(pickle_path):
+    if pickle_cache_dir:
+        return load_cached_session(
+            pickle_path, pickle_cache_dir, pickle_cache_max_bytes)
+    return load_pickle(pickle_path, skip_arrays=True)
+
+
+@pytest.fixture(scope="session")
+def checked_session(raw):
+    return CheckedSession.from_raw(raw)
+
+
+@pytest.fixture(scope="session")
+def extended_trials_df(pickle_path):
+    # built from the whole pickle, cached sessions are pruned
+    if pickle_cache_dir:
+        return load_cached_extended_trials_df(
+            pickle_path, pickle_cache_dir, pickle_cache_max_bytes)
+    return load_extended_trials_df(load_pickle(pickle_path))
+
+
+@pytest.fixture(scope="session")
+def extended_trials(extended_trials_df):
+    return CheckedExtendedTrials.from_df(extended_trials_df)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import typing
+
+import numpy as np
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+
+class CheckedExtendedTrials(typing.NamedTuple):
+    """Everything the checks read from the extended trials dataframe of a
+    session (`load_extended_trials_df`), built once and shared by all of them
+
+    Notes
+    -----
+    - one row per trial, every column is a numpy array
+    - autorewarded trials count as go trials, they change to a new image
+    """
+    df: pd.DataFrame
+    # row labels of the dataframe, the index of each trial
+    index: np.ndarray
+    go: np.ndarray
+    catch: np.ndarray
+    aborted: np.ndarray
+    autorewarded: np.ndarray
+    # number of licks before the change, every lick if the trial didnt change
+    early_licks: np.ndarray
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> "CheckedExtendedTrials":
+        trial_type = df["trial_type"].to_numpy()
+        autorewarded = trial_type == "autorewarded"
+        return cls(
+            df,
+            df.index.to_numpy(),
+            (trial_type == "go") | autorewarded,
+            trial_type == "catch",
+            trial_type == "aborted",
+            autorewarded,
+            count_early_licks(
+                df["lick_times"].to_numpy(),
+                df["change_time"].to_numpy(dtype=float),
+            ),
+        )
+
+
+def count_early_licks(lick_times: np.ndarray, change_time: np.ndarray) -> np.ndarray:
+    """Counts the licks of each trial before its change time, all of them if
+    the change time is nan
+
+    Notes
+    -----
+    - `lick_times` is an object array of the lick times of each trial, they're
+    flattened into one array so licks are compared all at once
+    """
+    n_licks = np.fromiter(
+        (len(times) for times in lick_times), dtype=int, count=len(lick_times))
+    if n_licks.sum() < 1:
+        return n_licks
+    licks = np.concatenate([
+        np.asarray(times, dtype=float) for times in lick_times
+    ])
+    trial = np.repeat(np.arange(len(lick_times)), n_licks)
+    lick_change_time = change_time[trial]
+    early = np.isnan(lick_change_time) | (licks < lick_change_time)
+    return np.bincount(
+        trial, weights=early, minlength=len(lick_times)).astype(int)
+
+
+def check_go_catch_change_image(trials: CheckedExtendedTrials) -> typing.List[int]:
+    """Tests that go trials change to a new image and catch trials change to
+    the image already shown
+    """
+    same_image = trials.df["initial_image_name"].to_numpy() == \
+        trials.df["change_image_name"].to_numpy()
+    bad = trials.go & same_image | trials.catch & ~same_image
+
+    return trials.index[bad].tolist()
+
+
+def check_response_types(trials: CheckedExtendedTrials) -> typing.List[int]:
+    """Tests that the response type of each trial follows from its trial type
+    and whether or not the mouse responded
+
+    Notes
+    -----
+    - go trials: HIT with a response, MISS without
+    - catch trials: FA with a response, CR without
+    - aborted trials: EARLY_RESPONSE
+    - autorewarded trials have weird response logic and arent checked, like
+    in `check_non_abort_event_log`
+    """
+    responded = trials.df["response"].to_numpy(dtype=float) == 1
+    go = trials.go & ~trials.autorewarded
+    expected = np.select(
+        [
+            trials.aborted,
+            go & responded,
+            go & ~responded,
+            trials.catch & responded,
+            trials.catch & ~responded,
+        ],
+        ["EARLY_RESPONSE", "HIT", "MISS", "FA", "CR", ],
+        default="",
+    )
+    response_type = trials.df["response_type"].to_numpy().astype(str)
+    bad = (expected != "") & (response_type != expected)
+
+    return trials.index[bad].tolist()
+
+
+def check_abort_early_licks(trials: CheckedExtendedTrials) -> typing.List[int]:
+    """Tests that aborted trials have a lick before the change and that
+    trials with a lick before the change are aborted
+    """
+    early = trials.early_licks > 0
+    bad = trials.aborted & ~early | \
+        (trials.go & ~trials.autorewarded | trials.catch) & early
+
+    return trials.index[bad].tolist()
+
+
+# every check, by name. A check returns the indices of the trials that fail
+# it, it raises if the dataframe cant be checked
+extended_checks: typing.Dict[str, typing.Callable[[CheckedExtendedTrials], typing.List[int]]] = {
+    "go_catch_change_image": check_go_catch_change_image,
+    "response_types": check_response_types,
+    "abort_early_licks": check_abort_early_licks,
+}
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import os
+import json
+import pickle
+import hashlib
+import typing
+
+from lazy_pickle import load_lazy, open_compressed
+from manifest import HashingReader, hash_file
+
+from . import load_extended_trials_df
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+
+# bump whenever prune_session changes
+cache_version = 1
+
+# bump whenever load_extended_trials_df changes
+extended_trials_cache_version = 1
+
+default_max_bytes = 4 * 1024 ** 3
+
+
+def prune_session(data: typing.Dict) -> typing.Dict:
+    """Only keeps the parts of a session the tests use
+    """
+    behavior = data["items"]["behavior"]
+    return {
+        "items": {
+            "behavior": {
+                "trial_log": behavior["trial_log"],
+                "params": {
+                    "initial_image_params": behavior["params"]["initial_image_params"],
+                },
+            },
+        },
+    }
+
+
+def cache_key(path: str, stat: os.stat_result) -> str:
+    encoded = "%s:%s:%s:%s" % (
+        os.path.abspath(path), stat.st_size, stat.st_mtime_ns, cache_version, )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def read_entry_metadata(cache_dir: str, key: str) -> typing.Union[typing.Dict, None]:
+    try:
+        with open(os.path.join(cache_dir, key + ".json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def evict(cache_dir: str, max_bytes: int) -> None:
+    """Removes least recently used entries until the cache fits in
+    `max_bytes`
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".pkl"):
+            continue
+        stat = os.stat(os.path.join(cache_dir, name))
+        entries.append((stat.st_mtime, stat.st_size, name[:-len(".pkl")], ))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        for suffix in (".pkl", ".json", ):
+            try:
+                os.remove(os.path.join(cache_dir, key + suffix))
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def write_entry(cache_dir: str, key: str, metadata: typing.Dict, value: typing.Any) -> None:
+    """Notes
+    -----
+    - the pickle is renamed into place before its metadata so a partially
+    written entry is never read
+    """
+    pickle_path = os.path.join(cache_dir, key + ".pkl")
+    tmp_path = "%s.%s.tmp" % (pickle_path, os.getpid(), )
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, pickle_path)
+
+    metadata_path = os.path.join(cache_dir, key + ".json")
+    tmp_path = "%s.%s.tmp" % (metadata_path, os.getpid(), )
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, metadata_path)
+
+
+def load_cached_session(
+    path: str,
+    cache_dir: str,
+    max_bytes: int = default_max_bytes,
+) -> typing.Dict:
+    """Loads the parts of a behavior pickle the tests use, from the cache if
+    its there
+
+    Notes
+    -----
+    - entries are keyed by the path, size and modification time of the
+    pickle so a hit never reads the network share the pickle lives on, the
+    content hash of the pickle is recorded with each entry
+    - least recently used entries are evicted to keep the cache under
+    `max_bytes`
+    """
+    stat = os.stat(path)
+    key = cache_key(path, stat)
+    entry_path = os.path.join(cache_dir, key + ".pkl")
+    if read_entry_metadata(cache_dir, key) is not None:
+        try:
+            with open(entry_path, "rb") as f:
+                session = pickle.load(f)
+            # mark as recently used
+            os.utime(entry_path)
+            return session
+        except FileNotFoundError:  # evicted by another process
+            pass
+
+    # a single read of the pickle to both hash and load it
+    with open(path, "rb") as f:
+        reader = HashingReader(f)
+        # arrays arent kept in the cache so dont build them
+        session = prune_session(load_lazy(open_compressed(reader, path)))
+        content_hash = reader.hexdigest()
+    metadata = {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "content_hash": content_hash,
+    }
+
+    os.makedirs(cache_dir, exist_ok=True)
+    write_entry(cache_dir, key, metadata, session)
+    evict(cache_dir, max_bytes)
+    return session
+
+
+def cached_content_hash(path: str, cache_dir: str) -> typing.Union[str, None]:
+    """Content hash of a pickle recorded in the cache, None if the pickle
+    isnt cached or changed since it was
+    """
+    metadata = read_entry_metadata(cache_dir, cache_key(path, os.stat(path)))
+    if metadata is None:
+        return None
+    return metadata["content_hash"]
+
+
+def visual_behavior_version() -> typing.Union[str, None]:
+    # imported here like in load_extended_trials_df, sessions are cached
+    # without it
+    import visual_behavior
+    return getattr(visual_behavior, "__version__", None)
+
+
+def extended_trials_key(content_hash: str) -> str:
+    encoded = "extended_trials:%s:%s:%s" % (
+        content_hash,
+        visual_behavior_version(),
+        extended_trials_cache_version,
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def load_cached_extended_trials_df(
+    path: str,
+    cache_dir: str,
+    max_bytes: int = default_max_bytes,
+) -> pd.DataFrame:
+    """Loads the extended trials dataframe of a behavior pickle, from the
+    cache if its there
+
+    Notes
+    -----
+    - entries are keyed by the content hash of the pickle and the
+    visual_behavior version so a new visual_behavior rebuilds them
+    - the content hash is taken from the session cache entry of the pickle
+    if it has one, otherwise the pickle is streamed through the hash. On a
+    miss its opened again to load it, neither holds the whole file in memory
+    - shares `cache_dir` and `max_bytes` with the session cache, entries of
+    both are evicted least recently used first
+    """
+    content_hash = cached_content_hash(path, cache_dir)
+    if content_hash is None:
+        content_hash = hash_file(path)
+
+    key = extended_trials_key(content_hash)
+    entry_path = os.path.join(cache_dir, key + ".pkl")
+    if read_entry_metadata(cache_dir, key) is not None:
+        try:
+            with open(entry_path, "rb") as f:
+                df = pickle.load(f)
+            # mark as recently used
+            os.utime(entry_path)
+            return df
+        except FileNotFoundError:  # evicted by another process
+            pass
+
+    with open(path, "rb") as f:
+        df = load_extended_trials_df(pickle.load(
+            open_compressed(f, path), encoding="latin1"))
+    metadata = {
+        "path": os.path.abspath(path),
+        "content_hash": content_hash,
+        "visual_behavior_version": visual_behavior_version(),
+    }
+
+    os.makedirs(cache_dir, exist_ok=True)
+    write_entry(cache_dir, key, metadata, df)
+    evict(cache_dir, max_bytes)
+    return df
@@ -0,0 +1,23 @@
+from .extended_checks import (
+    check_go_catch_change_image,
+    check_response_types,
+    check_abort_early_licks,
+)
+
+
+def test_go_catch_change_image(extended_trials):
+    bad_trial_indices = check_go_catch_change_image(extended_trials)
+    assert len(bad_trial_indices) < 1, \
+        f"Go trials should change to a new image and catch trials to the same image. Indices: {bad_trial_indices}"
+
+
+def test_response_types(extended_trials):
+    bad_trial_indices = check_response_types(extended_trials)
+    assert len(bad_trial_indices) < 1, \
+        f"Response types dont match the trial types and responses. Indices: {bad_trial_indices}"
+
+
+def test_abort_early_licks(extended_trials):
+    bad_trial_indices = check_abort_early_licks(extended_trials)
+    assert len(bad_trial_indices) < 1, \
+        f"Aborted trials should have a lick before the change and only aborted trials should. Indices: {bad_trial_indices}"
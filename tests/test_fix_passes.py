@@ -0,0 +1,137 @@
+import copy
+import pickle
+
+import pytest
+
+import fix_nondoc_pickle
+from synthetic_session import Faults, default_faults, make_session
+
+
+seeds = [0, 1, 2, ]
+n_trials = 300
+
+# every registered pass, the default ones and the initial image fix
+all_passes = fix_nondoc_pickle.default_fix_passes + ["initial_image", ]
+
+
+def baseline_fix_trials_initial_image(data: dict) -> dict:
+    """`fix_trials_initial_image` as it was written before it became a fix
+    pass, each change starts from the image the last change before it
+    changed to
+    """
+    fixed = copy.deepcopy(data)
+    prev = fix_nondoc_pickle.get_initial_image(data)
+    for trial in fixed["items"]["behavior"]["trial_log"]:
+        stimulus_changes = trial["stimulus_changes"]
+        if len(stimulus_changes) > 0:
+            if stimulus_changes[0][0][0] != prev:
+                fix_nondoc_pickle.overwrite_prev_image(trial, prev)
+            prev = stimulus_changes[0][1][0]
+    return fixed
+
+
+def fix_one_pass_at_a_time(data: dict, pass_names: list) -> dict:
+    for name in pass_names:
+        data = fix_nondoc_pickle.run_fix_passes(data, [name, ], copy_mode="deep")
+    return data
+
+
+@pytest.mark.parametrize("seed", seeds)
+@pytest.mark.parametrize("copy_mode", fix_nondoc_pickle.copy_modes)
+def test_single_traversal_matches_one_pass_at_a_time(seed, copy_mode):
+    data = make_session(n_trials, default_faults, seed)
+    expected = fix_one_pass_at_a_time(copy.deepcopy(data), all_passes)
+    unfixed = copy.deepcopy(data)
+
+    fixed = fix_nondoc_pickle.run_fix_passes(
+        data, all_passes, copy_mode=copy_mode)
+
+    assert fix_nondoc_pickle.objects_equal(fixed, expected)
+    if copy_mode != "inplace":
+        assert fix_nondoc_pickle.objects_equal(data, unfixed), \
+            f"{copy_mode} copy mode changed the session passed in"
+
+
+@pytest.mark.parametrize("seed", seeds)
+def test_initial_image_matches_baseline(seed):
+    # success None trials stay in the image sequence when they arent dropped
+    # in the same run
+    data = fix_nondoc_pickle.fix_images(make_session(
+        40, Faults(success_none=0.3, bad_initial_image=0.1), seed))
+
+    assert fix_nondoc_pickle.objects_equal(
+        fix_nondoc_pickle.fix_trials_initial_image(data),
+        baseline_fix_trials_initial_image(data),
+    )
+
+
+@pytest.mark.parametrize("seed", seeds)
+def test_patch_roundtrip(seed):
+    # fixed like fix_behavior_pickle fixes for a patch, the fixed session
+    # shares everything the fixes didnt change with the original
+    data = make_session(n_trials, default_faults, seed)
+    fixed = fix_nondoc_pickle.run_fix_passes(
+        data, fix_nondoc_pickle.default_fix_passes, copy_mode="shared")
+    patch = pickle.loads(pickle.dumps(
+        fix_nondoc_pickle.make_patch(data, fixed)))
+
+    fixed_trials = set(map(id, fixed["items"]["behavior"]["trial_log"]))
+    untouched = {
+        trial["index"] for trial in data["items"]["behavior"]["trial_log"]
+        if id(trial) in fixed_trials
+    }
+    assert len(untouched) > 0
+    assert len(untouched & set(patch["trials"])) < 1, \
+        "Trials the fixes didnt change are in the patch"
+    assert len(patch["trials"]) < len(data["items"]["behavior"]["trial_log"])
+    for key in ("encoders", "intervalsms", "params", ):
+        assert key not in patch["behavior"], \
+            f"Unchanged {key} is in the patch"
+
+    expected = copy.deepcopy(fixed)
+    patched = fix_nondoc_pickle.apply_patch(data, patch)
+
+    assert fix_nondoc_pickle.objects_equal(patched, expected)
+
+
+def test_patched_pickle_matches_fixed_pickle(tmp_path):
+    pickle_path = str(tmp_path / "session.behavior.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump(make_session(n_trials, default_faults), f, protocol=0)
+    output_dir = tmp_path / "fixed"
+    output_dir.mkdir()
+
+    fixed_path = fix_nondoc_pickle.fix_behavior_pickle(
+        pickle_path, str(output_dir))
+    patch_path = fix_nondoc_pickle.fix_behavior_pickle(
+        pickle_path, str(output_dir), output_mode="patch")
+
+    assert fix_nondoc_pickle.objects_equal(
+        fix_nondoc_pickle.load_patched_pickle(pickle_path, patch_path),
+        fix_nondoc_pickle.load_behavior_pickle(fixed_path),
+    )
+
+
+def test_failed_split_leaves_earlier_split(tmp_path, monkeypatch):
+    output_path = str(tmp_path / "session.behavior.split.pkl")
+    session = make_session(n_trials, default_faults)
+    fix_nondoc_pickle.write_split_pickle(session, output_path, min_bytes=1)
+    before = sorted(tmp_path.rglob("*"))
+    written = fix_nondoc_pickle.load_split_pickle(output_path, mmap_mode=None)
+
+    monkeypatch.setattr(
+        fix_nondoc_pickle, "objects_equal", lambda a, b: False)
+    with pytest.raises(Exception):
+        fix_nondoc_pickle.write_split_pickle(
+            make_session(n_trials, default_faults, 1),
+            output_path,
+            verify_roundtrip=True,
+            min_bytes=1,
+        )
+    monkeypatch.undo()
+
+    assert sorted(tmp_path.rglob("*")) == before
+    assert fix_nondoc_pickle.objects_equal(
+        written,
+        fix_nondoc_pickle.load_split_pickle(output_path, mmap_mode=None),
+    )
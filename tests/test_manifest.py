@@ -0,0 +1,38 @@
+import pickle
+
+import batch
+from manifest import is_fix_current
+from synthetic_session import default_faults, make_session
+
+
+# the default fix passes dont fix initial images
+fixable_faults = default_faults._replace(bad_initial_image=0.0)
+
+
+def test_unverified_output_is_fixed_again_with_verify_checks(tmp_path):
+    pickle_path = str(tmp_path / "session.behavior.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump(make_session(200, fixable_faults), f, protocol=0)
+    output_dir = str(tmp_path)
+
+    unverified = batch.fix_target_pickle(pickle_path, output_dir)
+    assert unverified.error is None
+    assert unverified.manifest_entry["verified"] is False
+    assert is_fix_current(pickle_path, unverified.manifest_entry)[0]
+    assert not is_fix_current(
+        pickle_path, unverified.manifest_entry, verify_checks=True)[0]
+
+    verified = batch.fix_target_pickle(
+        pickle_path, output_dir, unverified.manifest_entry, verify_checks=True)
+    assert verified.error is None
+    assert not verified.skipped
+    assert verified.manifest_entry["verified"] is True
+
+    # a verified output is current whether or not verification is asked for
+    for verify_checks in (False, True, ):
+        assert batch.fix_target_pickle(
+            pickle_path,
+            output_dir,
+            verified.manifest_entry,
+            verify_checks=verify_checks,
+        ).skipped
@@ -0,0 +1,32 @@
+import pytest
+
+import fix_nondoc_pickle
+from synthetic_session import default_faults, make_session
+
+from .checks import CheckedSession, run_checks
+
+
+# the default fix passes dont fix initial images
+fixable_faults = default_faults._replace(bad_initial_image=0.0)
+
+
+def test_empty_session():
+    behavior = make_session(0)["items"]["behavior"]
+    assert len(behavior["trial_log"]) < 1
+    assert len(behavior["encoders"][0]["dx"]) < 1
+    assert len(behavior["intervalsms"]) < 1
+
+
+@pytest.mark.parametrize("n_trials", [0, 1, 200, ])
+def test_fixed_session_passes_checks(n_trials):
+    fixed = fix_nondoc_pickle.run_fix_passes(
+        make_session(n_trials, fixable_faults),
+        fix_nondoc_pickle.default_fix_passes,
+    )
+    failed = [
+        result.check
+        for result in run_checks(CheckedSession.from_raw(fixed))
+        if result.error is not None or len(result.violations) > 0
+    ]
+    assert len(failed) < 1, \
+        f"Fixed synthetic session failed checks: {failed}"
@@ -0,0 +1,126 @@
+import json
+import multiprocessing
+import logging
+import logging.handlers
+from typing import Dict, List, NamedTuple, Optional
+
+
+# every fix, batch and watch logs to this logger, named so its the same when
+# fix_nondoc_pickle.py is run as a script
+logger = logging.getLogger("fix_nondoc_pickle")
+
+
+def transaction(session: Optional[str], fix: Optional[str] = None, trial: Optional[int] = None) -> Dict:
+    """Fields of a transaction log record, passed to the logger as `extra`
+    """
+    return {"session": session, "fix": fix, "trial": trial, }
+
+
+class TransactionLogHandler(logging.Handler):
+    """Writes log records as json lines, buffering them and writing
+    `capacity` records at a time
+
+    Notes
+    -----
+    - records at `flush_level` or above are written right away along with
+    everything buffered before them
+    """
+
+    def __init__(self, path: str, capacity: int = 1000, flush_level: int = logging.ERROR):
+        super().__init__()
+        self.stream = open(path, "a")
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.buffer = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.buffer.append(json.dumps({
+            "time": record.created,
+            "level": record.levelname,
+            "session": getattr(record, "session", None),
+            "trial": getattr(record, "trial", None),
+            "fix": getattr(record, "fix", None),
+            "message": record.getMessage(),
+        }))
+        if len(self.buffer) >= self.capacity or \
+                record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if len(self.buffer) > 0:
+                self.stream.write("\n".join(self.buffer) + "\n")
+                self.stream.flush()
+                self.buffer = []
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self.flush()
+        self.stream.close()
+        super().close()
+
+
+class TransactionLog(NamedTuple):
+    queue: multiprocessing.Queue
+    listener: logging.handlers.QueueListener
+    handler: TransactionLogHandler
+
+
+def attach_log_queue(log_queue: multiprocessing.Queue) -> None:
+    """Sends the records of `logger` to `log_queue`, called in every process
+    that fixes pickles
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+
+def open_transaction_log(path: str, capacity: int = 1000) -> TransactionLog:
+    """Starts writing the records of `logger` to a json lines transaction log
+    at `path` from a background thread
+
+    Notes
+    -----
+    - records are sent to the thread through a multiprocessing queue so
+    worker processes can log to the same file, see `attach_log_queue`
+    - nothing is logged until this is called
+    """
+    log_queue = multiprocessing.Queue()
+    handler = TransactionLogHandler(path, capacity)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    attach_log_queue(log_queue)
+    return TransactionLog(log_queue, listener, handler)
+
+
+def close_transaction_log(transaction_log: TransactionLog) -> None:
+    """Writes every queued record and stops logging
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    transaction_log.listener.stop()
+    transaction_log.handler.close()
+
+
+def read_transaction_log(
+    path: str,
+    session: Optional[str] = None,
+    trial: Optional[int] = None,
+) -> List[Dict]:
+    """Reads the records of a transaction log, optionally only the ones of a
+    session and/or trial index
+    """
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            if session is not None and record["session"] != session:
+                continue
+            if trial is not None and record["trial"] != trial:
+                continue
+            records.append(record)
+    return records
@@ -0,0 +1,232 @@
+import glob
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from catalog import open_catalog, record_validation
+from manifest import hash_file
+from tests import resolve_env_var, load_pickle, load_extended_trials_df
+from tests.checks import CheckedSession, run_checks
+from tests.extended_checks import CheckedExtendedTrials, extended_checks
+from tests.session_cache import load_cached_session, cached_content_hash, \
+    load_cached_extended_trials_df, default_max_bytes
+
+
+def load_session(pickle_path: str, cache_dir: Optional[str] = None,
+                 cache_max_bytes: int = default_max_bytes) -> Dict:
+    if cache_dir:
+        return load_cached_session(pickle_path, cache_dir, cache_max_bytes)
+    return load_pickle(pickle_path, skip_arrays=True)
+
+
+def load_extended_trials(pickle_path: str, cache_dir: Optional[str] = None,
+                         cache_max_bytes: int = default_max_bytes) -> CheckedExtendedTrials:
+    if cache_dir:
+        df = load_cached_extended_trials_df(
+            pickle_path, cache_dir, cache_max_bytes)
+    else:
+        df = load_extended_trials_df(load_pickle(pickle_path))
+    return CheckedExtendedTrials.from_df(df)
+
+
+def failure_record(pickle_path: str, error: str,
+                   content_hash: Optional[str] = None) -> Dict:
+    """The single record of a pickle that couldnt be checked, with check set
+    to None
+    """
+    return {
+        "pickle": pickle_path,
+        "content_hash": content_hash,
+        "check": None,
+        "violations": [],
+        "error": error,
+        "seconds": 0.0,
+    }
+
+
+def validate_pickle(pickle_path: str, cache_dir: Optional[str] = None,
+                    cache_max_bytes: int = default_max_bytes,
+                    hash_content: bool = False,
+                    extended_trials: bool = False) -> List[Dict]:
+    """Runs every check on a pickle
+
+    Returns
+    -------
+    list of report records, one per check
+
+    Notes
+    -----
+    - a pickle that fails to load gets a single record with check set to None
+    - records have the content hash of the pickle if its cached or
+    `hash_content` is True, None otherwise
+    - if `extended_trials` is True the checks of `tests.extended_checks` are
+    run on the extended trials dataframe too, it takes the whole pickle to
+    build so a pickle that fails to load it gets a single record with check
+    set to None
+    """
+    content_hash = None
+    try:
+        session = CheckedSession.from_raw(
+            load_session(pickle_path, cache_dir, cache_max_bytes))
+        results = run_checks(session)
+        del session
+        if extended_trials:
+            results += run_checks(
+                load_extended_trials(pickle_path, cache_dir, cache_max_bytes),
+                extended_checks,
+            )
+        if cache_dir:
+            content_hash = cached_content_hash(pickle_path, cache_dir)
+        if content_hash is None and hash_content:
+            content_hash = hash_file(pickle_path)
+    except Exception:
+        return [failure_record(
+            pickle_path, traceback.format_exc(), content_hash)]
+
+    return [
+        {
+            "pickle": pickle_path,
+            "content_hash": content_hash,
+            "check": result.check,
+            "violations": result.violations,
+            "error": result.error,
+            "seconds": result.seconds,
+        }
+        for result in results
+    ]
+
+
+def validate_pickles(pickle_paths: List[str], workers: int = 1,
+                     **kwargs) -> List[Dict]:
+    """Validates pickles, in parallel if workers > 1
+
+    Returns
+    -------
+    report records sorted by pickle so reports are comparable between runs
+
+    Notes
+    -----
+    - a pickle whose worker died gets a single failure record like a pickle
+    that fails to load, the other pickles are still validated
+    """
+    records = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(validate_pickle, pickle_path, **kwargs): pickle_path
+                for pickle_path in pickle_paths
+            }
+            for future in as_completed(futures):
+                try:
+                    records.extend(future.result())
+                except Exception:
+                    # the worker itself died, eg: it was killed for running
+                    # out of memory
+                    records.append(failure_record(
+                        futures[future], traceback.format_exc()))
+    else:
+        for pickle_path in pickle_paths:
+            records.extend(validate_pickle(pickle_path, **kwargs))
+
+    return sorted(records, key=lambda record: record["pickle"])
+
+
+def write_report(records: List[Dict], report_path: str):
+    with open(report_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def catalog_records(catalog_path: str, records: List[Dict]):
+    """Records a report in the catalog at `catalog_path`, a validation run
+    per pickle
+    """
+    by_pickle = {}
+    for record in records:
+        by_pickle.setdefault(record["pickle"], []).append(record)
+
+    connection = open_catalog(catalog_path)
+    try:
+        with connection:
+            for pickle_path, pickle_records in by_pickle.items():
+                record_validation(
+                    connection,
+                    pickle_path,
+                    pickle_records,
+                    pickle_records[0]["content_hash"],
+                )
+    finally:
+        connection.close()
+
+
+def print_summary(records: List[Dict]):
+    failed = [
+        record for record in records
+        if record["violations"] or record["error"]
+    ]
+    n_pickles = len(set(record["pickle"] for record in records))
+    n_failed_pickles = len(set(record["pickle"] for record in failed))
+    print("%s/%s pickles passed all checks." % (
+        n_pickles - n_failed_pickles, n_pickles, ))
+    for record in failed:
+        if record["error"]:
+            print("Error running %s on %s: %s" % (
+                record["check"], record["pickle"], record["error"], ))
+        else:
+            print("%s failed %s. Indices: %s" % (
+                record["pickle"], record["check"], record["violations"], ))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("report_path", type=str)
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        default=None,
+        help="Glob of pickles to validate, defaults to PICKLE_SEARCH_PATTERN",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes to validate pickles with",
+    )
+    parser.add_argument(
+        "--extended-trials",
+        action="store_true",
+        help="Also run the checks on the extended trials dataframe of each pickle",
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default=None,
+        help="Path of a sqlite catalog to record the violation counts in",
+    )
+
+    args = parser.parse_args()
+
+    pattern = args.pattern or resolve_env_var("PICKLE_SEARCH_PATTERN")
+    cache_dir = resolve_env_var("PICKLE_CACHE_DIR", required=False)
+    cache_max_bytes = int(resolve_env_var(
+        "PICKLE_CACHE_MAX_BYTES", required=False) or default_max_bytes)
+
+    records = validate_pickles(
+        sorted(glob.glob(pattern)),
+        workers=args.workers,
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        hash_content=args.catalog is not None,
+        extended_trials=args.extended_trials,
+    )
+    write_report(records, args.report_path)
+    if args.catalog is not None:
+        catalog_records(args.catalog, records)
+    print_summary(records)
+
+    if any(record["violations"] or record["error"] for record in records):
+        sys.exit(1)
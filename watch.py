@@ -0,0 +1,206 @@
+import os
+import glob
+import signal
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, \
+    wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from batch import FixResult, fix_target_pickle
+from manifest import save_manifest
+from transaction_log import attach_log_queue, logger, transaction
+
+
+def init_watch_worker(log_queue: Optional[multiprocessing.Queue]) -> None:
+    """Notes
+    -----
+    - workers ignore ctrl-c so an interrupted watch can finish the pickles
+    being fixed
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if log_queue is not None:
+        attach_log_queue(log_queue)
+
+
+class WatchedPickle(NamedTuple):
+    size: int
+    mtime: float
+    # time.time() when the size or modification time was last seen to change
+    changed_at: float
+
+
+class PickleWatcher:
+    """Polls the session directories directly under each of `roots` for new or
+    changed behavior pickles
+
+    Notes
+    -----
+    - a pickle is only reported once its size and modification time havent
+    changed for `settle_seconds`, so pickles still being copied onto the
+    share arent fixed half written
+    - a reported pickle is reported again if it changes
+    """
+
+    def __init__(self, roots: List[str], settle_seconds: float = 60.0):
+        self.roots = roots
+        self.settle_seconds = settle_seconds
+        self.pending: Dict[str, WatchedPickle] = {}
+        self.reported: Dict[str, Tuple[int, float]] = {}
+
+    def scan(self) -> Dict[str, Tuple[int, float]]:
+        stats = {}
+        for root in self.roots:
+            for path in glob.glob(os.path.join(root, "*", "*.behavior.pkl")):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # removed since it was listed
+                    continue
+                stats[path] = (stat.st_size, stat.st_mtime, )
+        return stats
+
+    def poll(self, now: Optional[float] = None) -> List[str]:
+        """Returns the pickles that settled since the last poll
+        """
+        if now is None:
+            now = time.time()
+        stats = self.scan()
+        self.pending = {
+            path: watched
+            for path, watched in self.pending.items()
+            if path in stats
+        }
+
+        settled = []
+        for path, stat in sorted(stats.items()):
+            if self.reported.get(path) == stat:
+                continue
+            watched = self.pending.get(path)
+            if watched is None or (watched.size, watched.mtime, ) != stat:
+                self.pending[path] = WatchedPickle(*stat, now)
+            elif now - watched.changed_at >= self.settle_seconds:
+                del self.pending[path]
+                self.reported[path] = stat
+                settled.append(path)
+        return settled
+
+
+def watch_behavior_pickles(
+    roots: List[str],
+    output_dir: str,
+    workers: int = 1,
+    manifest: Optional[Dict[str, Dict]] = None,
+    log_queue: Optional[multiprocessing.Queue] = None,
+    poll_seconds: float = 30.0,
+    settle_seconds: float = 60.0,
+    on_result: Optional[Callable[[FixResult], None]] = None,
+    max_polls: Optional[int] = None,
+    **kwargs
+) -> List[FixResult]:
+    """Fixes behavior pickles as they land in the session directories under
+    `roots`, until interrupted or `max_polls` polls are done
+
+    Notes
+    -----
+    - pickles are fixed in a pool of `workers` processes kept alive for the
+    whole watch, so only the first pickle pays for starting the workers and
+    importing the fixer
+    - pickles already in the `manifest` are skipped like in
+    `fix_behavior_pickles`, so restarting a watch only fixes what landed or
+    changed in the meantime
+    - `on_result` is called with each result as its pickle finishes, the
+    pickles that fail are retried when they change or the watch restarts
+    - a pickle that changes while its being fixed is fixed again after
+    - kwargs are passed to `fix_target_pickle`
+    """
+    watcher = PickleWatcher(roots, settle_seconds)
+    results = []
+    in_flight: Dict[Future, str] = {}
+    changed_in_flight = set()
+
+    def start_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_watch_worker,
+            initargs=(log_queue, ),
+        )
+
+    executor = start_pool()
+
+    def submit(target_pickle: str) -> None:
+        nonlocal executor
+        entry = manifest.get(target_pickle) if manifest is not None else None
+        try:
+            future = executor.submit(
+                fix_target_pickle, target_pickle, output_dir, entry, **kwargs)
+        except BrokenProcessPool:
+            # a worker was killed, eg: for running out of memory, which
+            # breaks the whole pool
+            executor.shutdown(wait=False)
+            executor = start_pool()
+            future = executor.submit(
+                fix_target_pickle, target_pickle, output_dir, entry, **kwargs)
+        in_flight[future] = target_pickle
+
+    def finish(future: Future) -> None:
+        target_pickle = in_flight.pop(future)
+        try:
+            result = future.result()
+        except Exception:
+            logger.error(
+                "Worker failed fixing pickle. target=%s.", target_pickle,
+                exc_info=True, extra=transaction(target_pickle))
+            result = FixResult(target_pickle, None, traceback.format_exc())
+
+        if manifest is not None and result.manifest_entry is not None:
+            manifest[target_pickle] = result.manifest_entry
+            save_manifest(output_dir, manifest)
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+        if target_pickle in changed_in_flight:
+            changed_in_flight.discard(target_pickle)
+            submit(target_pickle)
+
+    def wait_for_fixes(deadline: Optional[float]) -> None:
+        while len(in_flight) > 0:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return
+            done, _ = wait(
+                list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(future)
+
+    polls = 0
+    try:
+        while max_polls is None or polls < max_polls:
+            deadline = time.time() + poll_seconds
+            for target_pickle in watcher.poll():
+                if target_pickle in in_flight.values():
+                    changed_in_flight.add(target_pickle)
+                else:
+                    logger.info(
+                        "Fixing new or changed pickle: %s", target_pickle,
+                        extra=transaction(target_pickle))
+                    submit(target_pickle)
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                break
+            wait_for_fixes(deadline)
+            time.sleep(max(deadline - time.time(), 0))
+    except KeyboardInterrupt:
+        logger.info("Stopping watch, waiting for %s pickles", len(in_flight))
+    finally:
+        wait_for_fixes(None)
+        executor.shutdown()
+
+    return results
+
+